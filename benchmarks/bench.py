@@ -0,0 +1,289 @@
+# benchmarks/bench.py
+"""Offline Medusa benchmarks against the local fake providers.
+
+    python benchmarks/bench.py                  # every scenario
+    python benchmarks/bench.py downloads        # scenarios whose name starts with "downloads"
+    python benchmarks/bench.py --latency-ms 80 --error-rate 0.05 --json results.json
+    python benchmarks/bench.py startup          # import-time guard; exits 1 on a regression
+
+Each scenario runs in its own child process (with HOME pointed at a
+scratch directory) so caches, indexes and peak RSS never leak between
+scenarios or into the real library.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+PROVIDERS = ["Unsplash", "Pexels", "NASA", "ImageSearch"]
+
+# name -> (kind, params)
+SCENARIOS = {
+    "downloads_1x12": ("downloads", {"queries": 1, "count": 12}),
+    "downloads_4x6": ("downloads", {"queries": 4, "count": 6}),
+    "downloads_12x2": ("downloads", {"queries": 12, "count": 2}),
+    # The only scenario that keeps Medusa's rate limits; the others lift them
+    # so they measure parsing and transfer rather than the token buckets.
+    "downloads_ratelimited_4x6": ("downloads", {"queries": 4, "count": 6, "limits": True}),
+    "gallery_100": ("gallery", {"files": 100}),
+    "gallery_1000": ("gallery", {"files": 1000}),
+    "fallback_parse_60": ("fallback_parse", {"img_tags": 60, "pages": 200}),
+    "fallback_parse_600": ("fallback_parse", {"img_tags": 600, "pages": 50}),
+    "startup_daemon_check": ("startup", {"target": "daemon", "runs": 10, "budget_ms": 60}),
+    "startup_gui_import": ("startup", {"target": "gui", "runs": 5, "budget_ms": 400}),
+}
+
+# What each startup target runs in a fresh interpreter, and which heavy
+# modules it may load. The daemon check must stay clear of the download
+# stack; the GUI gets Pillow because customtkinter imports it anyway.
+STARTUP_TARGETS = {
+    "daemon": ("import medusa_daemon; medusa_daemon.run_once()", ()),
+    "gui": ("import medusa_gui", ("PIL",)),
+}
+# Rate limits high enough never to wait: every provider, the fallback sites
+# (limited per host, all 127.0.0.1 here) and image downloads.
+UNLIMITED = {name: (1e6, 1000000) for name in PROVIDERS + ["default", "download"]}
+
+HEAVY_MODULES = ("requests", "urllib3", "PIL", "lxml", "medusa_core", "medusa_imagesearch")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _result(items, seconds, latencies, **extra):
+    return dict({
+        "items": items,
+        "seconds": round(seconds, 3),
+        "per_sec": round(items / seconds, 2) if seconds else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "peak_rss_mb": peak_rss_mb()
+    }, **extra)
+
+
+# --- scenarios (run inside the child process) ---
+def bench_downloads(fake, scratch, queries, count, limits=False):
+    import medusa_core
+    cfg = dict(medusa_core.DEFAULT_CONFIG)
+    cfg.update({
+        "wall_dir": os.path.join(scratch, "walls"),
+        "apis": {p: "bench" for p in PROVIDERS},
+        "queries": [{"query": f"bench {i}", "count": count, "api": PROVIDERS[i % len(PROVIDERS)]}
+                    for i in range(queries)],
+        "nuke": False,
+        "dedup": False,
+        "metrics_file": None,
+        "rate_limits": {} if limits else UNLIMITED
+    })
+    t0 = time.perf_counter()
+    saved, latencies = 0, []
+    for r in medusa_core.iter_downloads(cfg):
+        if r["path"]:
+            saved += 1
+        if r["url"]:
+            # Per-image time from getting a provider slot to the file on disk.
+            latencies.append(r["timings"]["total"])
+    elapsed = time.perf_counter() - t0
+    return _result(saved, elapsed, latencies, requested=queries * count,
+                   server_requests=fake.requests)
+
+
+def bench_gallery(fake, scratch, files):
+    # Same data path as MedusaApp.load_gallery + its ThumbnailLoader, minus
+    # Tk: open and reconcile the folder's catalog, read the count and the
+    # first page, then decode the first screen of thumbnails. The cold pass
+    # builds the catalog; the warm pass reopens it as a restarted app would.
+    import threading
+    from medusa_catalog import get_catalog, forget_catalog
+    from medusa_thumbs import ThumbnailLoader
+    wall_dir = os.path.join(scratch, "walls")
+    os.makedirs(wall_dir, exist_ok=True)
+    src = os.path.join(wall_dir, "seed.jpg")
+    with open(src, "wb") as f:
+        f.write(fake.image_bytes(0))
+    for i in range(files):
+        shutil.copyfile(src, os.path.join(wall_dir, f"20250101_{i:06d}_Ben.jpg"))
+    os.remove(src)
+
+    first_screen = 15   # 3 columns x (3 visible + 2 slack) rows
+    gallery_page = 120  # medusa_gui.GALLERY_PAGE
+
+    def screen(label):
+        forget_catalog(wall_dir)
+        t0 = time.perf_counter()
+        catalog = get_catalog(wall_dir)
+        catalog.reconcile()
+        reconciled = time.perf_counter() - t0
+        catalog.count()
+        catalog.values("provider")
+        paths = catalog.page(0, gallery_page)
+        listed = time.perf_counter() - t0
+        done = threading.Event()
+        latencies, started = [], {}
+
+        def deliver(p, img):
+            latencies.append(time.perf_counter() - started[p])
+            if len(latencies) >= min(first_screen, len(paths)):
+                done.set()
+
+        loader = ThumbnailLoader(deliver)
+        for i, p in enumerate(paths[:first_screen]):
+            started[p] = time.perf_counter()
+            loader.request(p, priority=i)
+        done.wait(120)
+        return {f"{label}_reconcile_ms": round(reconciled * 1000, 1),
+                f"{label}_list_ms": round(listed * 1000, 1),
+                f"{label}_first_screen_ms": round((time.perf_counter() - t0) * 1000, 1)}, latencies
+
+    cold, cold_lat = screen("cold")
+    warm, warm_lat = screen("warm")
+    forget_catalog(wall_dir)
+    return _result(len(warm_lat), warm["warm_first_screen_ms"] / 1000.0, warm_lat,
+                   files=files, cold_p99_ms=round(percentile(cold_lat, 99) * 1000, 1), **cold, **warm)
+
+
+def bench_fallback_parse(fake, scratch, img_tags, pages):
+    import medusa_imagesearch
+    fake.img_tags = img_tags
+    fetch = medusa_imagesearch._site_page(medusa_imagesearch.FALLBACK_SITES[0])
+    latencies, found = [], 0
+    t0 = time.perf_counter()
+    for _ in range(pages):
+        t1 = time.perf_counter()
+        urls, _ = fetch("bench", "")
+        latencies.append(time.perf_counter() - t1)
+        found += len(urls)
+    return _result(pages, time.perf_counter() - t0, latencies, img_tags=img_tags, urls_found=found)
+
+
+def bench_startup(fake, scratch, target, runs, budget_ms):
+    # A daemon that finds nothing due: auto refresh on, last run just now.
+    with open(os.path.join(scratch, ".medusa_config.json"), "w") as f:
+        json.dump({"auto_refresh": True}, f)
+    with open(os.path.join(scratch, ".medusa_last_run"), "w") as f:
+        f.write("now")
+    snippet, allowed = STARTUP_TARGETS[target]
+    code = ("import sys, time, json; t0 = time.perf_counter(); " + snippet + "; "
+            "t = time.perf_counter() - t0; "
+            f"print('STARTUP ' + json.dumps([t, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))")
+    latencies, heavy = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        line = [ln for ln in out.stdout.splitlines() if ln.startswith("STARTUP ")]
+        if not line:
+            raise RuntimeError((out.stderr or "no output").strip().splitlines()[-1])
+        seconds, heavy = json.loads(line[0][len("STARTUP "):])
+        latencies.append(seconds)
+    unexpected = [m for m in heavy if m not in allowed]
+    p50_ms = percentile(latencies, 50) * 1000
+    return _result(runs, sum(latencies), latencies, target=target, budget_ms=budget_ms,
+                   heavy_loaded=unexpected, ok=p50_ms <= budget_ms and not unexpected)
+
+
+KINDS = {"downloads": bench_downloads, "gallery": bench_gallery, "fallback_parse": bench_fallback_parse,
+         "startup": bench_startup}
+
+
+def run_child(name, opts):
+    sys.path.insert(0, ROOT)
+    from fake_providers import FakeProviders
+    kind, params = SCENARIOS[name]
+    fake = FakeProviders(latency_ms=opts["latency_ms"], jitter_ms=opts["jitter_ms"],
+                         error_rate=opts["error_rate"], image_size=tuple(opts["image_size"]),
+                         truncate_rate=opts.get("truncate_rate", 0.0)).start()
+    try:
+        fake.install()
+        if not params.get("limits"):
+            from medusa_ratelimit import configure_limits
+            configure_limits(UNLIMITED)
+        result = KINDS[kind](fake, os.environ["HOME"], **params)
+    finally:
+        fake.stop()
+    print("BENCH_RESULT " + json.dumps(result))
+
+
+def run_scenario(name, opts):
+    scratch = tempfile.mkdtemp(prefix="medusa-bench-")
+    try:
+        env = dict(os.environ, HOME=scratch, USERPROFILE=scratch)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name,
+                              "--opts", json.dumps(opts)],
+                             env=env, capture_output=True, text=True, timeout=opts["timeout"])
+        for line in out.stdout.splitlines():
+            if line.startswith("BENCH_RESULT "):
+                return json.loads(line[len("BENCH_RESULT "):])
+        return {"error": (out.stderr or out.stdout).strip().splitlines()[-1:] or ["no output"]}
+    except subprocess.TimeoutExpired:
+        return {"error": ["timed out"]}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Medusa benchmarks")
+    parser.add_argument("only", nargs="*", help="run only scenarios starting with these names")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0,
+                        help="share of image bodies cut off half way (exercises resume)")
+    parser.add_argument("--image-size", default="1920x1080", help="WIDTHxHEIGHT of served images")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds per scenario")
+    parser.add_argument("--json", help="also write all results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--opts", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, json.loads(args.opts))
+        return 0
+
+    w, h = (int(v) for v in args.image_size.lower().split("x"))
+    opts = {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+            "truncate_rate": args.truncate_rate, "image_size": [w, h], "timeout": args.timeout}
+    names = [n for n in SCENARIOS if not args.only or any(n.startswith(o) for o in args.only)]
+    results = {}
+    failed = False
+    print(f"{'scenario':<22}{'items':>7}{'per_sec':>10}{'p50_ms':>9}{'p99_ms':>9}{'rss_mb':>9}")
+    for name in names:
+        r = results[name] = run_scenario(name, opts)
+        if "error" in r:
+            # A scenario that breaks can't vouch for its budget either.
+            failed = True
+            print(f"{name:<22}  ERROR {r['error'][0]}")
+            continue
+        print(f"{name:<22}{r['items']:>7}{r['per_sec'] or 0:>10}{r['p50_ms'] or 0:>9}"
+              f"{r['p99_ms'] or 0:>9}{r['peak_rss_mb'] or 0:>9}")
+        if r.get("ok") is False:
+            failed = True
+            print(f"{'':<22}  OVER BUDGET: p50 {r['p50_ms']} ms > {r['budget_ms']} ms"
+                  + (f", loaded {', '.join(r['heavy_loaded'])}" if r["heavy_loaded"] else ""))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": opts, "results": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+# benchmarks/fake_providers.py
+"""Local stand-in for every endpoint Medusa talks to.
+
+Serves the Unsplash random-photo JSON, Pexels search, NASA APOD, the
+DuckDuckGo vqd page and i.js, the HTML fallback sites, and the image files
+those responses point at. Latency, error rate and image size are
+configurable so benchmarks can model slow or flaky providers offline.
+Images carry an ETag and honour Range/If-Range, and `truncate_rate` cuts
+that share of image bodies off half way, to exercise resumed downloads.
+`stable_search` makes Pexels behave like the real search: the same page
+lists the same photos on every call.
+"""
+import io
+import json
+import time
+import random
+import threading
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+
+IMAGE_POOL = 48         # distinct pictures served; ids cycle through them
+DDG_PAGE_SIZE = 100
+
+
+class FakeProviders:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, image_size=(1920, 1080),
+                 img_tags=60, seed=1234, truncate_rate=0.0, stable_search=False):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.image_size = image_size
+        self.img_tags = img_tags
+        self.truncate_rate = truncate_rate
+        self.stable_search = stable_search
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._images = {}
+        self._server = None
+
+    # --- lifecycle ---
+    def start(self):
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def install(self):
+        """Point medusa_core / medusa_imagesearch at this server instead of the real APIs."""
+        import medusa_core
+        import medusa_imagesearch
+        medusa_core.APIS["Unsplash"]["url"] = self.base + "/unsplash/photos/random"
+        medusa_core.APIS["Pexels"]["url"] = self.base + "/pexels/v1/search"
+        medusa_core.APIS["NASA"]["url"] = self.base + "/nasa/planetary/apod"
+        medusa_imagesearch.DDG_URL = self.base + "/ddg/"
+        medusa_imagesearch.FALLBACK_SITES[:] = [
+            self.base + "/site/%d/search?q={query}" % i for i in range(3)
+        ]
+
+    # --- content ---
+    def next_image_url(self, prefix="wallpaper-1920"):
+        return f"{self.base}/img/{prefix}-{next(self._ids)}.jpg"
+
+    def image_bytes(self, n):
+        key = n % IMAGE_POOL
+        with self._lock:
+            data = self._images.get(key)
+        if data is None:
+            # A few random blocks scaled up: cheap to make, and distinct
+            # enough that the dedup index keeps them apart.
+            rng = random.Random(key)
+            small = Image.new("RGB", (8, 6))
+            small.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(48)])
+            buf = io.BytesIO()
+            small.resize(self.image_size, Image.Resampling.BILINEAR).save(buf, "JPEG", quality=85)
+            data = buf.getvalue()
+            with self._lock:
+                self._images[key] = data
+        return data
+
+    def fallback_html(self):
+        tags = []
+        for i in range(self.img_tags):
+            if i % 3 == 0:
+                tags.append(f'<img src="{self.base}/static/icon-{i}.svg">')
+            elif i % 3 == 1:
+                tags.append(f'<div class="thumb"><img data-src="{self.next_image_url()}" alt="x"></div>')
+            else:
+                tags.append(f'<figure><img src="{self.next_image_url("wallpaper-4k")}" '
+                            f'srcset="{self.next_image_url("small")} 640w"></figure>')
+        return "<html><body>" + "\n".join(tags) + "</body></html>"
+
+    def should_fail(self):
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def should_truncate(self):
+        with self._lock:
+            return self._rng.random() < self.truncate_rate
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            with self._lock:
+                extra = self._rng.uniform(0, self.jitter_ms)
+            time.sleep((self.latency_ms + extra) / 1000.0)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, ctype="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_image(self, data):
+        etag = '"%08x"' % (hash(data) & 0xFFFFFFFF)
+        start = 0
+        rng = self.headers.get("Range", "")
+        if rng.startswith("bytes=") and self.headers.get("If-Range", etag) == etag:
+            start = int(rng[6:].split("-")[0] or 0)
+            if start >= len(data):
+                return self._send(416, b"", "image/jpeg", {"Content-Range": f"bytes */{len(data)}"})
+        body = data[start:]
+        status, headers = 200, {"ETag": etag, "Accept-Ranges": "bytes"}
+        if start:
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+        if not self.fake.should_truncate():
+            return self._send(status, body, "image/jpeg", headers)
+        # Promise the whole body, send half, then drop the connection.
+        self.send_response(status)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2])
+        self.wfile.flush()
+        self.close_connection = True
+
+    def do_POST(self):
+        self.do_GET()
+
+    def do_GET(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        fake = self.fake
+        with fake._lock:
+            fake.requests += 1
+        fake.delay()
+        if fake.should_fail():
+            return self._send(503, b'{"error": "injected"}')
+
+        url = urlparse(self.path)
+        qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+        count = max(1, int(qs.get("count") or qs.get("per_page") or 1))
+        path = url.path
+
+        if path == "/unsplash/photos/random":
+            photos = [{"urls": {"raw": fake.next_image_url() + "?ixid=bench"}} for _ in range(count)]
+            return self._send(200, json.dumps(photos if "count" in qs else photos[0]))
+        if path == "/pexels/v1/search":
+            if fake.stable_search:
+                first = (int(qs.get("page") or 1) - 1) * count
+                photos = [{"src": {"original": f"{fake.base}/img/pexels-{first + i}.jpg"}} for i in range(count)]
+            else:
+                photos = [{"src": {"original": fake.next_image_url()}} for _ in range(count)]
+            return self._send(200, json.dumps({"photos": photos}))
+        if path == "/nasa/planetary/apod":
+            if "count" not in qs:
+                # Today's picture: the same all day, cacheable and revalidatable.
+                if self.headers.get("If-None-Match") == '"apod-today"':
+                    return self._send(304, b"", headers={"ETag": '"apod-today"'})
+                entry = {"media_type": "image", "hdurl": f"{fake.base}/img/wallpaper-apod-0.jpg"}
+                return self._send(200, json.dumps(entry), headers={"ETag": '"apod-today"',
+                                                                   "Cache-Control": "max-age=60"})
+            entries = [{"media_type": "image", "hdurl": fake.next_image_url()} for _ in range(count)]
+            return self._send(200, json.dumps(entries))
+        if path == "/ddg/":
+            return self._send(200, "<script>vqd='4-123456789012345';</script>", "text/html")
+        if path == "/ddg/i.js":
+            start = int(qs.get("s", 0))
+            results = [{"image": fake.next_image_url(), "title": "wallpaper"} for _ in range(DDG_PAGE_SIZE)]
+            nxt = f"i.js?q={qs.get('q', '')}&o=json&s={start + DDG_PAGE_SIZE}&vqd={qs.get('vqd', '')}"
+            return self._send(200, json.dumps({"results": results, "next": nxt}))
+        if path.startswith("/site/"):
+            return self._send(200, fake.fallback_html(), "text/html")
+        if path.startswith("/img/"):
+            n = int(path.rsplit("-", 1)[-1].split(".")[0])
+            return self._send_image(fake.image_bytes(n))
+        return self._send(404, b"{}")
@@ -0,0 +1,129 @@
+# medusa_cache.py
+import os
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".medusa_cache")
+FLUSH_SECONDS = 30.0    # longest a change waits in memory before it is written out
+
+_persisted = []         # every TTLCache with a disk copy, for flush_all()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    With `persist=True` the entries are mirrored to CACHE_DIR/<name>.json so
+    later processes (e.g. the next daemon run) start warm. Writes are
+    batched: the file is rewritten at most every FLUSH_SECONDS, and on
+    flush() / flush_all() (end of a run, interpreter exit). Values must be
+    JSON-serialisable.
+    """
+
+    def __init__(self, name, ttl, max_entries=256, persist=True):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = os.path.join(CACHE_DIR, f"{name}.json") if persist else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._data = None
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if self.path:
+            _persisted.append(self)
+
+    def _load(self):
+        # Called with the lock held; reads the disk copy once per process.
+        if self._data is not None:
+            return
+        self._data = OrderedDict()
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as f:
+                now = time.time()
+                for key, expires, value in json.load(f):
+                    if expires > now:
+                        self._data[key] = [expires, value]
+        except Exception:
+            pass
+
+    def _changed(self):
+        # Called with the lock held; True once the disk copy is due a rewrite.
+        self._dirty = True
+        return bool(self.path) and time.monotonic() - self._saved_at >= FLUSH_SECONDS
+
+    def flush(self):
+        """Write pending changes to disk; nothing happens if there are none."""
+        if not self.path:
+            return
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                rows = [[k, e, v] for k, (e, v) in self._data.items()]
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            # Serialised and written outside the lock so readers never wait on disk.
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(rows, f)
+                os.replace(tmp, self.path)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            item = self._data.get(key)
+            if item is None or item[0] <= time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, keep_expiry=False):
+        """Store `value`; with keep_expiry an existing entry keeps its original deadline."""
+        with self._lock:
+            self._load()
+            old = self._data.get(key)
+            expires = old[0] if keep_expiry and old else time.time() + self.ttl
+            self._data[key] = [expires, value]
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            due = self._changed()
+        if due:
+            self.flush()
+
+    def pop(self, key):
+        with self._lock:
+            self._load()
+            due = self._data.pop(key, None) is not None and self._changed()
+        if due:
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data or ())
+            return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+def flush_all():
+    """Write out every persisted cache's pending changes."""
+    for cache in list(_persisted):
+        cache.flush()
+
+
+atexit.register(flush_all)
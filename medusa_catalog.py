@@ -0,0 +1,218 @@
+# medusa_catalog.py
+import os
+import time
+import sqlite3
+import threading
+from PIL import Image
+
+CATALOG_FILE = ".medusa_catalog.sqlite"
+
+# Three-letter source tag in downloaded file names -> provider, for files
+# the catalog learns about from the folder rather than from save_image.
+NAME_TAGS = {"Uns": "Unsplash", "Pex": "Pexels", "NAS": "NASA", "Ima": "ImageSearch"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    provider TEXT,
+    query TEXT,
+    url TEXT,
+    width INTEGER,
+    height INTEGER,
+    bytes INTEGER,
+    downloaded REAL,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_downloaded ON images(downloaded);
+CREATE INDEX IF NOT EXISTS images_provider ON images(provider, downloaded);
+CREATE INDEX IF NOT EXISTS images_query ON images(query, downloaded);
+CREATE INDEX IF NOT EXISTS images_dims ON images(width, height);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def _provider_from_name(name):
+    # stamp_Src.ext (older files) or stamp_Src_suffix.ext
+    parts = os.path.splitext(name)[0].split("_")
+    return NAME_TAGS.get(parts[2]) if len(parts) >= 3 else None
+
+
+def _dims(path):
+    # Only the header is parsed; no pixel data is decoded.
+    try:
+        with Image.open(path) as im:
+            return im.size
+    except Exception:
+        return None, None
+
+
+class Catalog:
+    """SQLite record of every wallpaper in a wall_dir: source, query, URL, size, time.
+
+    Lives in wall_dir/.medusa_catalog.sqlite. save_image adds rows as files
+    arrive; reconcile() catches up with files added or removed by hand.
+    Files whose dimensions are unknown (unreadable) never show up in page().
+    """
+
+    def __init__(self, wall_dir):
+        self.wall_dir = wall_dir
+        self.path = os.path.join(wall_dir, CATALOG_FILE)
+        self._lock = threading.Lock()
+        os.makedirs(wall_dir, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error:
+            pass
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- writes ---
+    def add(self, path, provider=None, query=None, url=None, size=None, nbytes=None, downloaded=None):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        w, h = size if size else _dims(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.basename(path), provider, query, url, w, h,
+                 nbytes if nbytes is not None else st.st_size,
+                 downloaded if downloaded is not None else time.time(), st.st_mtime_ns))
+            self._db.commit()
+
+    def remove(self, path):
+        with self._lock:
+            self._db.execute("DELETE FROM images WHERE name = ?", (os.path.basename(path),))
+            self._db.commit()
+
+    def replace(self, old_path, new_path, size=None):
+        """Point a row at the rewritten file; provider, query, URL and time are kept."""
+        st = os.stat(new_path)
+        w, h = size if size else _dims(new_path)
+        with self._lock:
+            self._db.execute(
+                "UPDATE OR REPLACE images SET name = ?, width = ?, height = ?, bytes = ?, mtime_ns = ? "
+                "WHERE name = ?", (os.path.basename(new_path), w, h, st.st_size, st.st_mtime_ns,
+                                   os.path.basename(old_path)))
+            self._db.commit()
+
+    def mark_unreadable(self, path):
+        with self._lock:
+            self._db.execute("UPDATE images SET width = NULL, height = NULL WHERE name = ?",
+                             (os.path.basename(path),))
+            self._db.commit()
+
+    def reconcile(self, force=False):
+        """Sync with the folder; returns (added or changed, removed) counts.
+
+        Skipped outright while the folder's own mtime matches the last sync,
+        and only new or modified files (by mtime) have their header read.
+        """
+        try:
+            dir_mtime = str(os.stat(self.wall_dir).st_mtime_ns)
+        except OSError:
+            return 0, 0
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'dir_mtime_ns'").fetchone()
+            if not force and row and row[0] == dir_mtime:
+                return 0, 0
+            known = dict(self._db.execute("SELECT name, mtime_ns FROM images"))
+        seen, changed = set(), []
+        try:
+            with os.scandir(self.wall_dir) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    st = entry.stat()
+                    if known.get(entry.name) != st.st_mtime_ns:
+                        changed.append((entry.name, st))
+        except OSError:
+            return 0, 0
+        gone = [name for name in known if name not in seen]
+        rows = []
+        for name, st in changed:
+            w, h = _dims(os.path.join(self.wall_dir, name))
+            rows.append((name, _provider_from_name(name), w, h, st.st_size, st.st_mtime, st.st_mtime_ns))
+        with self._lock:
+            # Keep what save_image recorded (query, URL, time) for rewritten files.
+            self._db.executemany(
+                "INSERT INTO images (name, provider, width, height, bytes, downloaded, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                "width = excluded.width, height = excluded.height, bytes = excluded.bytes, "
+                "mtime_ns = excluded.mtime_ns", rows)
+            self._db.executemany("DELETE FROM images WHERE name = ?", [(n,) for n in gone])
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dir_mtime_ns', ?)", (dir_mtime,))
+            self._db.commit()
+        return len(rows), len(gone)
+
+    # --- queries ---
+    @staticmethod
+    def _where(provider=None, query=None, min_size=None):
+        clauses, args = ["width IS NOT NULL"], []
+        if provider:
+            clauses.append("provider = ?")
+            args.append(provider)
+        if query:
+            clauses.append("query = ?")
+            args.append(query)
+        if min_size:
+            clauses.append("width >= ? AND height >= ?")
+            args.extend(min_size)
+        return " AND ".join(clauses), args
+
+    def page(self, offset=0, limit=100, provider=None, query=None, min_size=None):
+        """Paths of one page of the library, newest first."""
+        where, args = self._where(provider, query, min_size)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT name FROM images WHERE {where} ORDER BY downloaded DESC, name DESC "
+                f"LIMIT ? OFFSET ?", args + [limit, offset]).fetchall()
+        return [os.path.join(self.wall_dir, name) for (name,) in rows]
+
+    def count(self, provider=None, query=None, min_size=None):
+        where, args = self._where(provider, query, min_size)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM images WHERE {where}", args).fetchone()[0]
+
+    def values(self, column):
+        """Distinct providers or queries in the library, for filter menus."""
+        if column not in ("provider", "query"):
+            raise ValueError(column)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT DISTINCT {column} FROM images WHERE {column} IS NOT NULL ORDER BY {column}")
+            return [v for (v,) in rows]
+
+    def get(self, path):
+        with self._lock:
+            cur = self._db.execute("SELECT * FROM images WHERE name = ?", (os.path.basename(path),))
+            row = cur.fetchone()
+            return dict(zip([c[0] for c in cur.description], row)) if row else None
+
+
+def get_catalog(wall_dir):
+    """Shared Catalog for `wall_dir` (one connection per directory per process)."""
+    key = os.path.abspath(wall_dir)
+    with _catalogs_lock:
+        cat = _catalogs.get(key)
+        if cat is None:
+            cat = _catalogs[key] = Catalog(key)
+        return cat
+
+
+def forget_catalog(wall_dir):
+    """Close the cached Catalog for `wall_dir`, e.g. before its folder is renamed."""
+    with _catalogs_lock:
+        cat = _catalogs.pop(os.path.abspath(wall_dir), None)
+    if cat is not None:
+        cat.close()
@@ -0,0 +1,85 @@
+# medusa_cli.py
+import sys
+import json
+import argparse
+import contextlib
+from medusa_config import load_config
+
+
+def read_queries(lines, api, count):
+    """cfg['queries'] entries from text lines, one at a time.
+
+    A line is either a JSON object ({"query": ..., "count": ..., "api": ...};
+    missing keys take the command-line defaults) or a plain search query.
+    Blank lines and lines starting with # are skipped.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            try:
+                q = json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable line: {line}", file=sys.stderr)
+                continue
+            if not isinstance(q, dict):
+                continue
+            yield {"query": q.get("query", ""), "count": q.get("count", count), "api": q.get("api", api)}
+        else:
+            yield {"query": line, "count": count, "api": api}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download wallpapers for a list of queries without the GUI, "
+                    "writing one JSON result per image to stdout")
+    parser.add_argument("queries", nargs="?", default="-",
+                        help="file with one query per line (plain text or JSON), - for stdin")
+    parser.add_argument("--api", default="ImageSearch", help="source for lines that don't name one")
+    parser.add_argument("--count", type=int, default=1, help="images per query for lines that don't say")
+    parser.add_argument("--wall-dir", help="download folder (default: the configured one)")
+    parser.add_argument("--workers", type=int, help="parallel downloads (default: the configured max_workers)")
+    parser.add_argument("--no-dedup", action="store_true", help="keep duplicates of images already in the library")
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    if args.wall_dir:
+        cfg["wall_dir"] = args.wall_dir
+    if args.workers:
+        cfg["max_workers"] = args.workers
+    if args.no_dedup:
+        cfg["dedup"] = False
+    # Adds to the library: a nuking run would hold every result back until
+    # the swap, which defeats streaming.
+    cfg["nuke"] = False
+
+    from medusa_core import iter_downloads
+    out = sys.stdout
+    source = sys.stdin if args.queries == "-" else open(args.queries, "r", encoding="utf-8")
+    saved = failed = 0
+    try:
+        # Medusa's log lines go to stderr so stdout stays pure JSON lines.
+        with contextlib.redirect_stdout(sys.stderr):
+            cfg["queries"] = read_queries(source, args.api, args.count)
+            for result in iter_downloads(cfg):
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                if result["path"]:
+                    saved += 1
+                else:
+                    failed += 1
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head); nothing left to report to.
+        return 0
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"{saved} saved, {failed} failed", file=sys.stderr)
+    return 0 if saved or not failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
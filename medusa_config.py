@@ -0,0 +1,101 @@
+# medusa_config.py
+import os
+import json
+from medusa_metrics import METRICS_FILE
+
+# Kept free of requests/PIL so the daemon's due check and the GUI can read
+# the config without loading the download stack.
+
+HOME = os.path.expanduser("~")
+DEFAULT_WALLDIR = os.path.join(HOME, "Medusa")
+CONFIG_FILE = os.path.join(HOME, ".medusa_config.json")
+LAST_RUN_FILE = os.path.join(HOME, ".medusa_last_run")
+
+APIS = {
+    "Unsplash": {"key": "", "url": "https://api.unsplash.com/photos/random"},
+    "Pexels": {"key": "", "url": "https://api.pexels.com/v1/search"},
+    "NASA": {"key": "DEMO_KEY", "url": "https://api.nasa.gov/planetary/apod"}
+}
+
+# Max simultaneous downloads per provider; anything not listed uses "default".
+PROVIDER_LIMITS = {
+    "Unsplash": 2,
+    "Pexels": 3,
+    "NASA": 1,
+    "ImageSearch": 4,
+    "default": 2
+}
+
+HTTP_DEFAULTS = {
+    "pool_size": 8,        # keep-alive connections kept per host
+    "retries": 3,          # attempts for connect errors and transient 5xx
+    "backoff": 0.5         # seconds; doubled on every retry
+}
+
+POSTPROCESS_DEFAULTS = {
+    "enabled": False,
+    "sizes": None,          # [[w, h], ...] monitors to cover; None = cfg["display_size"]
+    "crop": False,          # center-crop to the first size's aspect ratio
+    "format": "jpeg",       # jpeg, webp, png, or "keep" for the downloaded format
+    "quality": 90,
+    "strip_metadata": True,
+    "workers": 0            # 0 = half the CPUs
+}
+
+ROTATION_DEFAULTS = {
+    "enabled": False,
+    "interval_minutes": 30,
+    "min_buffer": 2,        # ready wallpapers kept per query, at least...
+    "max_buffer": 12        # ...and at most, whatever the rates say
+}
+
+DEFAULT_CONFIG = {
+    "wall_dir": DEFAULT_WALLDIR,
+    "apis": {name: data["key"] for name, data in APIS.items()},
+    "queries": [
+        {"query": "cyberpunk city 4k", "count": 3, "api": "Pexels"},
+        {"query": "space nebula", "count": 2, "api": "Unsplash"}
+    ],
+    "nuke": True,
+    "nuke_min_success": 0.6,
+    "max_library_files": 0,
+    "max_library_mb": 0,
+    "eviction": "lru",
+    "auto_refresh": False,
+    "refresh_hours": 24.0,
+    "max_workers": 6,
+    "provider_limits": dict(PROVIDER_LIMITS),
+    "http": dict(HTTP_DEFAULTS),
+    "max_image_mb": 60,
+    "dedup": True,
+    "metrics_file": METRICS_FILE,
+    "display_size": [2560, 1440],
+    "min_resolution": [1280, 720],
+    "aspect_range": [1.0, 3.6],
+    "rate_limits": {},
+    "postprocess": dict(POSTPROCESS_DEFAULTS),
+    "rotation": dict(ROTATION_DEFAULTS),
+    "profile": False
+}
+
+def load_config():
+    try:
+        if os.path.exists(CONFIG_FILE):
+            with open(CONFIG_FILE, "r") as f:
+                cfg = json.load(f)
+                for k, v in DEFAULT_CONFIG.items():
+                    if k not in cfg:
+                        cfg[k] = v
+                if "apis" not in cfg:
+                    cfg["apis"] = {name: data["key"] for name, data in APIS.items()}
+                return cfg
+    except Exception:
+        pass
+    return DEFAULT_CONFIG.copy()
+
+def save_config(cfg):
+    try:
+        with open(CONFIG_FILE, "w") as f:
+            json.dump(cfg, f, indent=2)
+    except Exception:
+        pass
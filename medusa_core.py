@@ -1,178 +1,809 @@
 # medusa_core.py
+import io
 import os
+import sys
 import json
 import time
-import requests
+import uuid
+import hashlib
+import cProfile
+import pstats
+import threading
+import multiprocessing
 from datetime import datetime
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import requests
 from PIL import Image
-try:
-    from medusa_imagesearch import get_imagesearch_results
-    HAS_IMAGESEARCH = True
-except ImportError:
-    HAS_IMAGESEARCH = False
-
-HOME = os.path.expanduser("~")
-DEFAULT_WALLDIR = os.path.join(HOME, "Medusa")
-CONFIG_FILE = os.path.join(HOME, ".medusa_config.json")
-LAST_RUN_FILE = os.path.join(HOME, ".medusa_last_run")
-os.makedirs(DEFAULT_WALLDIR, exist_ok=True)
-
-APIS = {
-    "Unsplash": {"key": "", "url": "https://api.unsplash.com/photos/random"},
-    "Pexels": {"key": "", "url": "https://api.pexels.com/v1/search"},
-    "NASA": {"key": "DEMO_KEY", "url": "https://api.nasa.gov/planetary/apod"}
-}
-
-DEFAULT_CONFIG = {
-    "wall_dir": DEFAULT_WALLDIR,
-    "apis": {name: data["key"] for name, data in APIS.items()},
-    "queries": [
-        {"query": "cyberpunk city 4k", "count": 3, "api": "Pexels"},
-        {"query": "space nebula", "count": 2, "api": "Unsplash"}
-    ],
-    "nuke": True,
-    "auto_refresh": False,
-    "refresh_hours": 24.0
-}
-
-def load_config():
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r") as f:
-                cfg = json.load(f)
-                for k, v in DEFAULT_CONFIG.items():
-                    if k not in cfg:
-                        cfg[k] = v
-                if "apis" not in cfg:
-                    cfg["apis"] = {name: data["key"] for name, data in APIS.items()}
-                return cfg
-    except Exception:
-        pass
-    return DEFAULT_CONFIG.copy()
+from medusa_index import get_index, perceptual_hash
+from medusa_thumbs import make_thumbnail
+from medusa_catalog import get_catalog
+from medusa_postprocess import postprocess_options, process_image
+from medusa_retention import begin_staging, commit_staging, discard_staging, enforce_retention
+import medusa_metrics as metrics
+from medusa_http import configure_from_config, http_stats
+from medusa_ratelimit import limited_request, configure_limits, save_state as save_ratelimit_state
+from medusa_httpcache import cached_get, cache_stats as http_cache_stats
+from medusa_cache import flush_all as flush_caches
+# Config lives in medusa_config so light callers can read it without this
+# module's dependencies; the names stay importable from here as before.
+from medusa_config import (HOME, DEFAULT_WALLDIR, CONFIG_FILE, LAST_RUN_FILE, APIS, PROVIDER_LIMITS,  # noqa: F401
+                           HTTP_DEFAULTS, DEFAULT_CONFIG, load_config, save_config)
+
+# Largest batch each API hands out in a single call.
+UNSPLASH_MAX_COUNT = 30
+PEXELS_MAX_PER_PAGE = 80
+# Python 3.12+ profiles through sys.monitoring: one profiler sees every
+# thread, and a second one can't be enabled while it is active.
+PROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+
+# Provider calls per query when earlier results are already in the library.
+MAX_RESOLVE_PAGES = 4
+
+CHUNK_SIZE = 64 * 1024
+PROBE_BYTES = 256 * 1024    # give up looking for the image header after this much
+
+# Interrupted downloads stay in wall_dir/.parts and are continued with a
+# Range request on retry or on a later run that sees the same URL.
+PART_DIR = ".parts"
+PART_MAX_AGE = 7 * 24 * 3600
+RESUME_ATTEMPTS = 2
 
-def save_config(cfg):
+# Leading bytes of the formats Pillow can verify -> file extension.
+IMAGE_MAGIC = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff")
+]
+
+def _imagesearch():
+    # Imported on first use so runs without ImageSearch queries never load it.
     try:
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(cfg, f, indent=2)
-    except Exception:
-        pass
+        import medusa_imagesearch
+        return medusa_imagesearch
+    except ImportError:
+        return None
 
 def _log(msg):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[Medusa] {ts} - {msg}")
 
-def get_image_url(api_name, key, query):
-    try:
-        if api_name == "Unsplash":
-            resp = requests.get(APIS[api_name]["url"], params={
-                "client_id": key, "query": query, "orientation": "landscape"
-            }, timeout=10)
-            data = resp.json()
-            if isinstance(data, dict) and data.get("urls"):
-                return data["urls"].get("raw") + "&auto=format&fit=crop"
-        elif api_name == "Pexels":
-            resp = requests.get(APIS[api_name]["url"], headers={"Authorization": key}, params={
-                "query": query, "per_page": 1, "page": 1
-            }, timeout=10)
-            data = resp.json()
-            photos = data.get("photos")
-            if photos:
-                return photos[0]["src"].get("original")
-        elif api_name == "NASA":
-            resp = requests.get(APIS[api_name]["url"], params={"api_key": key}, timeout=10)
-            data = resp.json()
-            if data.get("media_type") != "image":
-                return None
-            return data.get("hdurl") or data.get("url")
-       
-        elif api_name == "ImageSearch":
-            if not HAS_IMAGESEARCH:
-                _log("ImageSearch module not found.")
-                return None
-            urls = get_imagesearch_results(query, count=1)
-            if urls:
-                return urls[0]
+def _unsplash_url(photo, display_size=None):
+    if isinstance(photo, dict) and photo.get("urls") and photo["urls"].get("raw"):
+        url = photo["urls"]["raw"] + "&auto=format&fit=crop"
+        if display_size:
+            # Let Unsplash's image CDN scale the original to the screen size.
+            url += f"&w={int(display_size[0])}&h={int(display_size[1])}"
+        return url
+    return None
+
+def _apod_url(entry):
+    if not isinstance(entry, dict) or entry.get("media_type") != "image":
+        return None
+    return entry.get("hdurl") or entry.get("url")
+
+def get_image_urls(api_name, key, query, count=1, display_size=None):
+    """Resolve up to `count` image URLs with as few provider calls as possible.
 
+    `display_size` (w, h) asks providers that can resize server-side for
+    that size instead of the full original.
+    """
+    return _get_image_urls(api_name, key, query, count, display_size)[0]
+
+def _get_image_urls(api_name, key, query, count, display_size=None, known=None):
+    # get_image_urls that also hands back what went wrong, for iter_downloads.
+    # URLs for which known(url) is true are dropped and further pages asked
+    # for instead, so a provider with stable results still yields new images.
+    count = max(1, int(count))
+    urls, seen, error = [], set(), None
+    try:
+        with metrics.timer("resolve", api_name):
+            for page in range(1, (MAX_RESOLVE_PAGES if known else 1) + 1):
+                batch = [u for u in _resolve(api_name, key, query, count, display_size, page)
+                         if u and u not in seen]
+                if not batch:
+                    break   # the provider has nothing more
+                seen.update(batch)
+                urls.extend(u for u in batch if not (known and known(u)))
+                if len(urls) >= count:
+                    break
     except Exception as e:
-        _log(f"get_image_url error ({api_name}): {e}")
+        error = e
+        metrics.failure(api_name, e)
+        _log(f"get_image_urls error ({api_name}): {e}")
+    if known and len(seen) > len(urls):
+        _log(f"Skipped {len(seen) - len(urls)} already downloaded {api_name} results for '{query}'")
+    return urls[:count], error
+
+def _resolve(api_name, key, query, count, display_size=None, page=1):
+    urls = []
+    if api_name == "Unsplash":
+        # The random endpoint has no pages; asking again draws new photos, so
+        # it bypasses the HTTP cache.
+        resp = limited_request(api_name, "GET", APIS[api_name]["url"], params={
+            "client_id": key, "query": query, "orientation": "landscape",
+            "count": min(count, UNSPLASH_MAX_COUNT)
+        }, timeout=10)
+        resp.raise_for_status()
+        data = resp.json()
+        # With `count` the endpoint returns a list; without it a single photo.
+        photos = data if isinstance(data, list) else [data]
+        urls = [_unsplash_url(p, display_size) for p in photos]
+    elif api_name == "Pexels":
+        resp = cached_get(api_name, APIS[api_name]["url"], headers={"Authorization": key}, params={
+            "query": query, "per_page": min(count, PEXELS_MAX_PER_PAGE), "page": page
+        }, timeout=10)
+        resp.raise_for_status()
+        data = resp.json()
+        urls = [p.get("src", {}).get("original") for p in data.get("photos") or []]
+    elif api_name == "NASA":
+        if count > 1 or page > 1:
+            # A single call with `count` returns that many random APOD entries,
+            # a new draw every time, so it isn't cached.
+            resp = limited_request(api_name, "GET", APIS[api_name]["url"],
+                                   params={"api_key": key, "count": count}, timeout=10)
+        else:
+            # Without it the API only ever has today's picture.
+            resp = cached_get(api_name, APIS[api_name]["url"], params={"api_key": key}, timeout=10)
+        resp.raise_for_status()
+        data = resp.json()
+        entries = data if isinstance(data, list) else [data]
+        urls = [_apod_url(e) for e in entries]
+    elif api_name == "ImageSearch":
+        imagesearch = _imagesearch()
+        if imagesearch is None:
+            _log("ImageSearch module not found.")
+            return []
+        # Later pages ask for more results; the ones already seen are dropped.
+        urls = imagesearch.get_imagesearch_results(query, count=count * page)
+    return urls
+
+def get_image_url(api_name, key, query):
+    urls = get_image_urls(api_name, key, query, count=1)
+    return urls[0] if urls else None
+
+def _unique_name(src, ext):
+    # Timestamp keeps the gallery's name sort chronological; the random suffix
+    # keeps names unique when several workers finish within the same second.
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f"{stamp}_{src[:3]}_{uuid.uuid4().hex[:8]}.{ext}"
+
+def sniff_format(head):
+    """Map the leading bytes of a file to an extension, or None if not an image."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, ext in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return ext
     return None
 
-def save_image(url, src, wall_dir=None):
-    if wall_dir is None:
-        wall_dir = DEFAULT_WALLDIR
+def _probe_size(head):
+    """(width, height) parsed from the first bytes of an image, or None if not there yet."""
     try:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        img = r.content
-        ext = url.split(".")[-1].split("?")[0]
-        if len(ext) > 5 or "/" in ext or len(ext) == 0:
-            ext = "jpg"
-        fname = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{src[:3]}.{ext}"
-        os.makedirs(wall_dir, exist_ok=True)
-        path = os.path.join(wall_dir, fname)
-        with open(path, "wb") as f:
-            f.write(img)
+        with Image.open(io.BytesIO(head)) as im:
+            return im.size
+    except Exception:
+        return None
+
+def check_dimensions(size, size_filter):
+    """Raise ImageRejected if `size` misses the minimum resolution or aspect range."""
+    if not size_filter or not size:
+        return
+    w, h = size
+    min_w, min_h = size_filter.get("min_size") or (0, 0)
+    if w < min_w or h < min_h:
+        raise ImageRejected("too_small", f"{w}x{h} is below {min_w}x{min_h}")
+    aspect = size_filter.get("aspect")
+    if aspect and h and not (aspect[0] <= w / h <= aspect[1]):
+        raise ImageRejected("aspect", f"{w}x{h} aspect {w / h:.2f} outside {aspect[0]}-{aspect[1]}")
+
+class ImageRejected(ValueError):
+    """A download that was refused on purpose; `category` names the reason in the metrics."""
+    def __init__(self, category, msg):
+        super().__init__(msg)
+        self.category = category
+
+def _part_path(url, part_dir):
+    folder = os.path.join(part_dir, PART_DIR)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, hashlib.sha1(url.encode("utf-8")).hexdigest()[:24] + ".part")
+
+def _part_state(part):
+    """(bytes already on disk, validator to resume them with) for a .part file."""
+    try:
+        with open(part + ".json", "r") as f:
+            validator = json.load(f).get("validator")
+        have = os.path.getsize(part)
+    except Exception:
+        return 0, None
+    return (have, validator) if have and validator else (0, None)
+
+def _discard_part(part):
+    for path in (part, part + ".json"):
         try:
-            Image.open(path).verify()
-        except Exception:
             os.remove(path)
-            return None
-        return path
+        except OSError:
+            pass
+
+def _resume_validator(headers):
+    # If-Range needs a strong ETag; Last-Modified is the fallback.
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+def _range_start(headers):
+    # "bytes 1000-1999/2000" -> 1000
+    try:
+        return int(headers.get("Content-Range", "").split()[1].split("-")[0])
+    except Exception:
+        return None
+
+def _part_chunks(part):
+    with open(part, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            yield chunk
+
+_active_parts = set()
+_active_parts_lock = threading.Lock()
+
+def _stream_to_temp(url, wall_dir, max_bytes=None, src=None, size_filter=None, part_dir=None):
+    # Streams the body into a hidden .part file next to its final location,
+    # hashing and sniffing it on the way so nothing is buffered in memory.
+    # With a size_filter the image header is parsed from the first chunks
+    # and the transfer is aborted right there if the picture doesn't qualify.
+    # A transfer cut short keeps its .part and validator for a Range resume.
+    part = _part_path(url, part_dir or wall_dir)
+    with _active_parts_lock:
+        if part in _active_parts:
+            raise ImageRejected("duplicate", "already being downloaded")
+        _active_parts.add(part)
+    try:
+        return _fetch_part(url, part, max_bytes, src, size_filter)
+    except ImageRejected:
+        _discard_part(part)
+        raise
+    finally:
+        with _active_parts_lock:
+            _active_parts.discard(part)
+
+def _fetch_part(url, part, max_bytes, src, size_filter):
+    have, validator = _part_state(part)
+    headers = {"Range": f"bytes={have}-", "If-Range": validator} if have else {}
+    with metrics.timer("connect", src):
+        # Image CDNs don't share the API quotas, so they get a bucket per host.
+        r = limited_request(urlparse(url).netloc, "GET", url, download=True, timeout=30, stream=True,
+                            headers=headers)
+    with r:
+        if r.status_code == 416 and have:
+            # The stored part no longer fits the file; start it over.
+            r.close()
+            _discard_part(part)
+            return _fetch_part(url, part, max_bytes, src, size_filter)
+        r.raise_for_status()
+        resumed = have if r.status_code == 206 and _range_start(r.headers) == have else 0
+        length = r.headers.get("Content-Length", "")
+        if max_bytes and length.isdigit() and resumed + int(length) > max_bytes:
+            raise ImageRejected("too_large", f"{resumed + int(length)} bytes exceeds limit of {max_bytes}")
+        if resumed:
+            _log(f"Resuming {url} at {resumed} bytes")
+        else:
+            with open(part + ".json", "w") as f:
+                json.dump({"url": url, "validator": _resume_validator(r.headers)}, f)
+
+        state = {"size": 0, "head": b"", "ext": None,
+                 "probe": b"" if size_filter else None, "digest": hashlib.sha256()}
+
+        def take(chunk):
+            state["size"] += len(chunk)
+            if max_bytes and state["size"] > max_bytes:
+                raise ImageRejected("too_large", f"body exceeds limit of {max_bytes} bytes")
+            if state["ext"] is None and len(state["head"]) < 16:
+                state["head"] = (state["head"] + chunk)[:16]
+                if len(state["head"]) >= 12:
+                    state["ext"] = sniff_format(state["head"])
+                    if state["ext"] is None:
+                        raise ImageRejected("not_image", "response is not a supported image")
+            if state["probe"] is not None:
+                state["probe"] += chunk
+                dims = _probe_size(state["probe"])
+                if dims or len(state["probe"]) >= PROBE_BYTES:
+                    # Header too deep to find cheaply: verify decides later.
+                    check_dimensions(dims, size_filter)
+                    state["probe"] = None
+            state["digest"].update(chunk)
+
+        received = 0
+        try:
+            if resumed:
+                # The bytes already on disk count toward the hash and the checks.
+                for chunk in _part_chunks(part):
+                    take(chunk)
+            with metrics.timer("transfer", src), open(part, "ab" if resumed else "wb") as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    received += len(chunk)
+                    take(chunk)
+                    f.write(chunk)
+        finally:
+            metrics.add_bytes(src, received)
+        ext = state["ext"] or sniff_format(state["head"])
+        if ext is None:
+            raise ImageRejected("not_image", "response is not a supported image")
+        return part, ext, state["digest"].hexdigest(), state["size"]
+
+def _download_part(url, src, wall_dir, max_bytes, size_filter, part_dir):
+    for attempt in range(RESUME_ATTEMPTS + 1):
+        try:
+            return _stream_to_temp(url, wall_dir, max_bytes, src, size_filter, part_dir)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout) as e:
+            if attempt == RESUME_ATTEMPTS:
+                raise
+            _log(f"Transfer of {url} interrupted ({e}); retrying")
+
+def _prune_parts(wall_dir):
+    # Parts whose URL never came back are dropped after a while.
+    folder = os.path.join(wall_dir, PART_DIR)
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return
+    cutoff = time.time() - PART_MAX_AGE
+    for name in names:
+        path = os.path.join(folder, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def save_image(url, src, wall_dir=None, max_bytes=None, dedup=True, size_filter=None, query=None,
+               part_dir=None):
+    """Download, verify and file one image; returns its path or None.
+
+    Partial transfers are kept under `part_dir` (default wall_dir)/.parts
+    and resumed by the next call for the same URL.
+    """
+    try:
+        return _save_image(url, src, wall_dir, max_bytes, dedup, size_filter, query, part_dir)["path"]
     except Exception as e:
+        metrics.failure(src, e)
         _log(f"save_image error: {e}")
     return None
 
-def run_downloads(cfg, show_progress=None):
-    wall_dir = cfg.get("wall_dir", DEFAULT_WALLDIR)
-    if cfg.get("nuke", False):
+def _save_image(url, src, wall_dir=None, max_bytes=None, dedup=True, size_filter=None, query=None,
+                part_dir=None):
+    # save_image that raises instead of returning None; returns
+    # {"path", "bytes", "size"} for iter_downloads' results.
+    if wall_dir is None:
+        wall_dir = DEFAULT_WALLDIR
+    os.makedirs(wall_dir, exist_ok=True)
+    tmp, ext, sha256, nbytes = _download_part(url, src, wall_dir, max_bytes, size_filter, part_dir)
+    try:
+        with metrics.timer("verify", src):
+            with Image.open(tmp) as im:
+                dims = im.size
+                im.verify()
+            phash = perceptual_hash(tmp) if dedup else None
+    except Exception:
+        _discard_part(tmp)
+        raise ImageRejected("verify", "image failed verification")
+    try:
+        # Catches images whose header was past the probe window.
+        check_dimensions(dims, size_filter)
+    except ImageRejected:
+        _discard_part(tmp)
+        raise
+    with metrics.timer("write", src):
+        path = os.path.join(wall_dir, _unique_name(src, ext))
+        index = get_index(wall_dir) if dedup else None
+        if index is not None:
+            dup = index.add_if_new(path, url, sha256, phash)
+            if dup:
+                _discard_part(tmp)
+                raise ImageRejected("duplicate", f"duplicate of {dup}")
+        # Only a verified file ever appears under its real name.
         try:
-            for f in os.listdir(wall_dir):
-                try:
-                    os.remove(os.path.join(wall_dir, f))
-                except Exception:
-                    pass
+            os.replace(tmp, path)
+            # A resumed part may date from an earlier run; the file counts as new.
+            os.utime(path)
         except Exception:
-            pass
-    total = 0
-    for q in cfg.get("queries", []):
+            if index is not None:
+                index.remove(path)
+            raise
+        _discard_part(tmp)
         try:
-            total += int(q.get("count", 0))
-        except Exception:
-            pass
-    if total == 0:
-        _log("No images to download (total 0)")
-        return []
+            get_catalog(wall_dir).add(path, src, query, url, dims, nbytes)
+        except Exception as e:
+            _log(f"catalog error: {e}")
+        try:
+            make_thumbnail(path)
+        except Exception as e:
+            _log(f"thumbnail error: {e}")
+    metrics.current().add_image()
+    return {"path": path, "bytes": nbytes, "size": list(dims)}
 
-    downloaded = []
-    for q in cfg.get("queries", []):
-        query = q.get("query", "").strip()
+def _provider_semaphores(cfg, providers):
+    limits = dict(PROVIDER_LIMITS)
+    limits.update(cfg.get("provider_limits") or {})
+    sems = {}
+    for name in providers:
         try:
-            count = int(q.get("count", 0))
+            n = int(limits.get(name, limits.get("default", 2)))
         except Exception:
-            count = 0
+            n = 1
+        sems[name] = threading.BoundedSemaphore(max(1, n))
+    return sems
+
+def _max_bytes(cfg):
+    try:
+        return int(float(cfg.get("max_image_mb", 0)) * 1024 * 1024) or None
+    except Exception:
+        return None
+
+def _size_filter(cfg):
+    min_size = cfg.get("min_resolution")
+    aspect = cfg.get("aspect_range")
+    if not min_size and not aspect:
+        return None
+    return {"min_size": tuple(min_size) if min_size else None, "aspect": tuple(aspect) if aspect else None}
+
+def _resolve_urls(api_name, key, query, count, cfg, limit):
+    known = get_index(cfg.get("wall_dir", DEFAULT_WALLDIR)).has_url if cfg.get("dedup", True) else None
+    with limit:
+        return _get_image_urls(api_name, key, query, count, cfg.get("display_size"), known)
+
+def _result(api_name, query, url=None):
+    """One iter_downloads entry; error and category stay None on success."""
+    return {"path": None, "provider": api_name, "query": query, "url": url, "bytes": 0,
+            "size": None, "timings": {}, "error": None, "category": None}
+
+def _failed(result, exc):
+    result["error"] = str(exc)
+    result["category"] = metrics.classify(exc)
+    return result
+
+def _download_one(url, api_name, query, cfg, limit):
+    wall_dir = cfg.get("wall_dir", DEFAULT_WALLDIR)
+    dedup = cfg.get("dedup", True)
+    result = _result(api_name, query, url)
+    t0 = time.perf_counter()
+    with metrics.collect() as timings:
+        if dedup and get_index(wall_dir).has_url(url):
+            metrics.failure(api_name, "known_url")
+            _log(f"Skipping {url}: already in library")
+            _failed(result, ImageRejected("known_url", "already in library"))
+        else:
+            try:
+                with limit:
+                    timings["queued"] = time.perf_counter() - t0
+                    result.update(_save_image(url, api_name, wall_dir, _max_bytes(cfg), dedup,
+                                              _size_filter(cfg), query, cfg.get("part_dir")))
+            except Exception as e:
+                metrics.failure(api_name, e)
+                _log(f"save_image error: {e}")
+                _failed(result, e)
+    # "queued" is the wait for a provider slot; "total" is the rest, rate limiting included.
+    timings["total"] = time.perf_counter() - t0 - timings.get("queued", 0.0)
+    result["timings"] = {k: round(v, 4) for k, v in timings.items()}
+    return result
+
+def _parse_query(q, cfg):
+    """(api_name, key, query, count) for a usable cfg['queries'] entry, else None."""
+    try:
+        query = str(q.get("query", "")).strip()
+        count = int(q.get("count", 0))
         api_name = q.get("api")
-        if not query or count <= 0 or not api_name:
-            continue
-        key = cfg.get("apis", {}).get(api_name, "").strip()
-        if not key and api_name != "ImageSearch":
-            _log(f"Skipping {api_name} for '{query}' — no API key")
+    except Exception:
+        return None
+    if not query or count <= 0 or not api_name:
+        return None
+    return api_name, (cfg.get("apis", {}).get(api_name) or "").strip(), query, count
+
+def _finish_staging(wall_dir, staging, saved, total, cfg):
+    """Swap the staged library in if enough of it arrived; returns whether it was."""
+    try:
+        threshold = float(cfg.get("nuke_min_success", 0.6))
+    except Exception:
+        threshold = 0.6
+    if not saved or saved < threshold * total:
+        discard_staging(staging)
+        _log(f"Only {saved}/{total} images arrived; keeping the current library")
+        return False
+    try:
+        commit_staging(wall_dir, staging)
+    except Exception as e:
+        _log(f"library swap error: {e}")
+        discard_staging(staging)
+        return False
+    return True
+
+def _apply_retention(wall_dir, started, cfg):
+    try:
+        max_files = int(cfg.get("max_library_files") or 0)
+        max_bytes = int(float(cfg.get("max_library_mb") or 0) * 1024 * 1024)
+    except Exception:
+        return
+    evicted = enforce_retention(wall_dir, max_files, max_bytes, cfg.get("eviction", "lru"), kept_since=started)
+    if evicted:
+        _log(f"Evicted {len(evicted)} old wallpapers to stay within the library limits")
+
+def _postprocess_pool(post):
+    # Spawned rather than forked: the parent is full of threads and open
+    # sockets, and the workers only need medusa_postprocess.
+    return ProcessPoolExecutor(max_workers=post["workers"], mp_context=multiprocessing.get_context("spawn"))
+
+def _postprocessed(result, post_result):
+    """Bring index, catalog and the run result up to date with a post-processed file."""
+    path, src, new = result["path"], result["provider"], post_result["path"]
+    folder = os.path.dirname(path)
+    if new != path:
+        get_index(folder).rename(path, new)
+    try:
+        get_catalog(folder).replace(path, new, post_result["size"])
+    except Exception as e:
+        _log(f"catalog error: {e}")
+    metrics.current().record("postprocess_cpu", post_result["cpu_s"], src)
+    metrics.current().add_saved(src, post_result["before"] - post_result["after"])
+    result.update(path=new, bytes=post_result["after"], size=post_result["size"])
+    result["timings"]["postprocess"] = round(post_result["wall_s"], 4)
+    return result
+
+def _profiled(profiles, fn, *args):
+    # Before 3.12 cProfile only sees the thread it runs in, so each pool task
+    # gets its own profiler and they are merged when the run ends.
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        return fn(*args)    # another profiler is active; run unprofiled
+    try:
+        return fn(*args)
+    finally:
+        prof.disable()
+        profiles.append(prof)
+
+def _submit(pool, profiles, fn, *args):
+    if profiles is None:
+        return pool.submit(metrics.bind(fn), *args)
+    return pool.submit(metrics.bind(_profiled), profiles, fn, *args)
+
+def _dump_profile(profiles):
+    path = os.path.join(HOME, f".medusa_profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+    try:
+        stats = pstats.Stats(profiles[0])
+        for prof in profiles[1:]:
+            stats.add(prof)
+        stats.dump_stats(path)
+        _log(f"Profile written to {path}")
+    except Exception as e:
+        _log(f"profile dump error: {e}")
+
+def run_downloads(cfg, show_progress=None):
+    """Download every configured query; returns the saved paths.
+
+    A thin wrapper over iter_downloads() for callers that want the whole
+    list; `show_progress(path)` is called for each image as it is saved.
+    """
+    paths = []
+    for result in iter_downloads(cfg):
+        if not result["path"]:
             continue
-        for _ in range(count):
-            url = get_image_url(api_name, key, query)
-            if url:
-                path = save_image(url, api_name, wall_dir=wall_dir)
-                if path:
-                    downloaded.append(path)
-                    if show_progress:
-                        try:
-                            show_progress(path)
-                        except Exception:
-                            pass
-            time.sleep(0.3)
-    _log(f"Downloaded {len(downloaded)}/{total} images")
+        paths.append(result["path"])
+        if show_progress:
+            try:
+                show_progress(result["path"])
+            except Exception:
+                pass
+    return paths
+
+def iter_downloads(cfg):
+    """Download every configured query, yielding one result dict per image as it completes.
+
+    Each result has "path" (None on failure), "provider", "query", "url",
+    "bytes", "size", "timings" (stage -> seconds) and "error"/"category"
+    (None on success). A query that fails to resolve yields a single result
+    without a URL. cfg['queries'] may be any iterable, e.g. a generator over
+    a file: it is read lazily and only a few queries are in flight at once.
+
+    Stage timings are appended to cfg['metrics_file'] as one JSON line per
+    run (see medusa_metrics); cfg['profile'] also dumps merged cProfile stats.
+    With cfg['nuke'] the new library replaces wall_dir only if at least
+    cfg['nuke_min_success'] of the requested images arrived, and its results
+    are yielded once that is decided; otherwise max_library_files /
+    max_library_mb evict old wallpapers (see medusa_retention).
+    Runs with cfg['background'] (rotation refills) don't count as the last
+    run: they leave last_run() and LAST_RUN_FILE alone.
+    """
+    run = metrics.start_run()
+    profiles = [] if cfg.get("profile") else None
+    prof = None
+    if profiles is not None:
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            profiles.append(prof)
+        except ValueError as e:
+            _log(f"profiling unavailable: {e}")
+            prof = profiles = None
+    try:
+        yield from _iter_downloads(cfg, None if PROFILE_ALL_THREADS else profiles)
+    finally:
+        if prof is not None:
+            prof.disable()
+        save_ratelimit_state()
+        flush_caches()
+        summary = metrics.finish_run(run, cfg.get("metrics_file", metrics.METRICS_FILE),
+                                     remember=not cfg.get("background"))
+        _log(f"Run metrics: {metrics.format_summary(summary)}")
+        if profiles:
+            _dump_profile(profiles)
+
+def _iter_downloads(cfg, profiles=None):
+    wall_dir = cfg.get("wall_dir", DEFAULT_WALLDIR)
+    started = time.time()
+    configure_from_config(cfg)
+    configure_limits(cfg.get("rate_limits"))
+    _prune_parts(wall_dir)
+    try:
+        workers = max(1, int(cfg.get("max_workers", 6)))
+    except Exception:
+        workers = 1
+
+    # A nuking run builds the new library in a staging folder and only swaps
+    # it in once enough of it arrived; until then wall_dir stays untouched.
+    staging = begin_staging(wall_dir) if cfg.get("nuke", False) else None
+    if staging:
+        # Partial downloads stay with the real library so a failed run's
+        # parts survive the discarded staging folder.
+        cfg = dict(cfg, wall_dir=staging, part_dir=wall_dir)
+    elif cfg.get("nuke", False):
+        _log("Could not create a staging folder; keeping the current library")
+    staged = []     # a staged run's saved images, held back until the swap
+
+    post = postprocess_options(cfg)
+    post_pool = None
+    limits = {}
+    providers = set()
+    queries = iter(cfg.get("queries") or [])
+    more_queries = True
+    # Enough queued work to keep every worker busy, without reading (and
+    # resolving) the whole query list up front.
+    backlog = workers * 2
+    total = saved = 0
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        resolving = {}      # future -> (provider, query)
+        downloading = {}    # future -> (provider, query, url)
+        processing = {}     # future -> result of the download being post-processed
+        pending = set()
+        while True:
+            out = []
+            while more_queries and len(pending) < backlog:
+                q = next(queries, None)
+                if q is None:
+                    more_queries = False
+                    break
+                job = _parse_query(q, cfg) if isinstance(q, dict) else None
+                if job is None:
+                    continue
+                api_name, key, query, count = job
+                total += count
+                if not key and api_name != "ImageSearch":
+                    _log(f"Skipping {api_name} for '{query}' — no API key")
+                    out.append(_failed(_result(api_name, query), ImageRejected("no_api_key", "no API key")))
+                    continue
+                if api_name not in limits:
+                    limits.update(_provider_semaphores(cfg, [api_name]))
+                providers.add(api_name)
+                f = _submit(pool, profiles, _resolve_urls, api_name, key, query, count, cfg, limits[api_name])
+                resolving[f] = (api_name, query)
+                pending.add(f)
+            if not pending and not out:
+                break
+            done = ()
+            if pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                job = resolving.pop(fut, None)
+                download = downloading.pop(fut, None)
+                post_of = processing.pop(fut, None)
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    if post_of:
+                        # The original file is untouched; keep it as downloaded.
+                        _log(f"post-process error for {post_of['path']}: {e}")
+                        out.append(post_of)
+                    else:
+                        # Still reported, so a query never silently vanishes.
+                        _log(f"download worker error: {e}")
+                        api_name, query, url = download or (job + (None,))
+                        out.append(_failed(_result(api_name, query, url), e))
+                    continue
+                if job:
+                    api_name, query = job
+                    urls, error = result
+                    if not urls:
+                        out.append(_failed(_result(api_name, query),
+                                           error or ImageRejected("no_results", "no images found")))
+                    for url in urls:
+                        f = _submit(pool, profiles, _download_one, url, api_name, query, cfg, limits[api_name])
+                        downloading[f] = (api_name, query, url)
+                        pending.add(f)
+                elif post_of:
+                    out.append(_postprocessed(post_of, result))
+                elif result["path"] and post:
+                    try:
+                        # Post-processing is CPU bound, so it gets processes of its own
+                        # and runs alongside the remaining downloads instead of after them.
+                        if post_pool is None:
+                            post_pool = _postprocess_pool(post)
+                        f = post_pool.submit(process_image, result["path"], post)
+                    except Exception as e:
+                        # A broken pool must not cost the download itself.
+                        _log(f"post-processing unavailable: {e}")
+                        if post_pool is not None:
+                            post_pool.shutdown(wait=False)
+                        post_pool, post = None, None
+                        out.append(result)
+                        continue
+                    processing[f] = result
+                    pending.add(f)
+                else:
+                    out.append(result)
+            # Results are yielded from the calling thread, in completion order.
+            for result in out:
+                if result["path"]:
+                    saved += 1
+                    if staging:
+                        staged.append(result)
+                        continue
+                yield result
+
+        if not total:
+            _log("No images to download (total 0)")
+            return
+        _log(f"Downloaded {saved}/{total} images")
+        if staging:
+            swapped = _finish_staging(wall_dir, staging, saved, total, cfg)
+            staging = None
+            for result in staged:
+                if swapped:
+                    result["path"] = os.path.join(wall_dir, os.path.basename(result["path"]))
+                else:
+                    result["path"] = None
+                    _failed(result, ImageRejected("not_swapped", "run discarded; the current library was kept"))
+                yield result
+        else:
+            # Files from this run are never evicted; some filesystems keep whole-second mtimes.
+            _apply_retention(wall_dir, int(started), cfg)
+    finally:
+        # Also reached when the caller stops iterating early.
+        pool.shutdown(cancel_futures=True)
+        if post_pool is not None:
+            post_pool.shutdown(cancel_futures=True)
+        if staging:
+            discard_staging(staging)
+    stats = http_stats()
+    _log(f"HTTP connections: {stats['opened']} opened, {stats['reused']} reused "
+         f"over {stats['requests']} requests")
+    c = http_cache_stats()
+    _log(f"API responses: {c['fresh']} from cache, {c['revalidated']} revalidated, {c['fetched']} fetched")
+    if "ImageSearch" in providers and _imagesearch():
+        for name, c in _imagesearch().cache_stats().items():
+            _log(f"ImageSearch {name} cache: {c['hits']} hits, {c['misses']} misses")
+    if cfg.get("background"):
+        return
     try:
         with open(LAST_RUN_FILE, "w") as f:
             f.write(datetime.now().isoformat())
     except Exception:
         pass
-    return downloaded
@@ -1,7 +1,23 @@
 # medusa_daemon.py
 import os
+import sys
+import json
 import time
-from medusa_core import load_config, run_downloads, LAST_RUN_FILE
+import random
+import argparse
+# Only the config and metrics helpers are imported up front: most daemon
+# invocations just find nothing due and exit, and shouldn't pay for the
+# download stack (requests, Pillow, ...). run_due() imports it on demand.
+from medusa_config import load_config, LAST_RUN_FILE, CONFIG_FILE, HOME
+from medusa_metrics import last_run, format_summary
+
+LOCK_FILE = os.path.join(HOME, ".medusa_daemon.lock")
+STATE_FILE = os.path.join(HOME, ".medusa_daemon_state.json")
+
+CONFIG_POLL_SECONDS = 60        # how often a sleeping scheduler looks at the config
+MAX_JITTER_SECONDS = 300
+JITTER_FRACTION = 0.05          # of the query's interval, capped at MAX_JITTER_SECONDS
+
 
 def hours_since_last_run():
     try:
@@ -11,18 +27,197 @@ def hours_since_last_run():
     except Exception:
         return float('inf')
 
-def main():
+
+def acquire_lock(path=LOCK_FILE):
+    """Take the single-instance lock; returns the open lock file, or None if held elsewhere.
+
+    The OS drops the lock when the process exits, so a crashed daemon never
+    leaves a stale lock behind.
+    """
+    f = open(path, "a+")
+    try:
+        f.seek(0)
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    f.truncate()
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def save_state(state):
+    try:
+        tmp = STATE_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, STATE_FILE)
+    except Exception:
+        pass
+
+
+def query_key(q):
+    return f"{q.get('api')}|{q.get('query', '').strip()}"
+
+
+def query_interval(cfg, q):
+    """Refresh interval of one query in hours; falls back to the global refresh_hours."""
+    try:
+        return max(0.1, float(q.get("refresh_hours", cfg.get("refresh_hours", 24.0))))
+    except Exception:
+        return 24.0
+
+
+def _last_run(state, q):
+    # Queries without their own record yet inherit the old global last-run time.
+    last = state.get(query_key(q))
+    if last is not None:
+        return last
+    try:
+        return os.path.getmtime(LAST_RUN_FILE)
+    except OSError:
+        return 0.0
+
+
+def due_queries(cfg, state, now=None):
+    now = time.time() if now is None else now
+    return [q for q in cfg.get("queries", [])
+            if now - _last_run(state, q) >= query_interval(cfg, q) * 3600.0]
+
+
+def seconds_until_due(cfg, state, now=None):
+    now = time.time() if now is None else now
+    waits = [_last_run(state, q) + query_interval(cfg, q) * 3600.0 - now
+             for q in cfg.get("queries", [])]
+    return max(0.0, min(waits)) if waits else None
+
+
+def run_due(cfg, state, due, profile=False):
+    """Download the due queries and record their run time in `state`."""
+    from medusa_core import iter_downloads
+    run_cfg = dict(cfg)
+    run_cfg["queries"] = due
+    if profile:
+        run_cfg["profile"] = True
+    # Nuking replaces the whole library, so it only makes sense when every query
+    # is being refreshed in this run.
+    if len(due) < len(cfg.get("queries", [])):
+        run_cfg["nuke"] = False
+    paths = [r["path"] for r in iter_downloads(run_cfg) if r["path"]]
+    now = time.time()
+    for q in due:
+        state[query_key(q)] = now
+    save_state(state)
+    return paths
+
+
+def run_once(profile=False):
     cfg = load_config()
     if not cfg.get("auto_refresh", False):
         print("Auto refresh disabled in config. Exiting.")
         return
-    interval = float(cfg.get("refresh_hours", 24.0))
-    if hours_since_last_run() < max(0.1, interval):
+    state = load_state()
+    due = due_queries(cfg, state)
+    if not due:
         print("Not time yet. Exiting.")
         return
     print("Running Medusa daemon downloads...")
-    paths = run_downloads(cfg)
+    paths = run_due(cfg, state, due, profile)
     print(f"Downloaded {len(paths)} images")
+    print(f"Metrics: {format_summary(last_run())}")
+
+
+def _config_mtime():
+    try:
+        return os.path.getmtime(CONFIG_FILE)
+    except OSError:
+        return None
+
+
+def _jitter(cfg):
+    # Spreads refreshes out so machines (or queries sharing an interval)
+    # don't hit the providers in lockstep.
+    shortest = min([query_interval(cfg, q) for q in cfg.get("queries", [])] or [24.0]) * 3600.0
+    return random.uniform(0, min(MAX_JITTER_SECONDS, JITTER_FRACTION * shortest))
+
+
+def run_forever(profile=False):
+    """Resident scheduler: sleep until the next query is due, then refresh it."""
+    cfg, cfg_mtime = load_config(), _config_mtime()
+    state = load_state()
+    next_run = None
+    print("Medusa scheduler started.")
+    while True:
+        mtime = _config_mtime()
+        if mtime != cfg_mtime:
+            cfg, cfg_mtime = load_config(), mtime
+            next_run = None
+            print("Config changed on disk; reloaded.")
+
+        now = time.time()
+        if not cfg.get("auto_refresh", False):
+            next_run = None
+        elif next_run is None:
+            until = seconds_until_due(cfg, state, now)
+            if until is not None:
+                next_run = now + until + _jitter(cfg)
+        if next_run is not None and now >= next_run:
+            next_run = None
+            due = due_queries(cfg, state)
+            if due:
+                print(f"Refreshing {len(due)} due queries...")
+                try:
+                    paths = run_due(cfg, state, due, profile)
+                    print(f"Downloaded {len(paths)} images")
+                    print(f"Metrics: {format_summary(last_run())}")
+                except Exception as e:
+                    # Stay resident; the failed queries are retried next cycle.
+                    print(f"Refresh failed: {e}")
+                    time.sleep(CONFIG_POLL_SECONDS)
+            continue
+
+        # Wake up at least every CONFIG_POLL_SECONDS to notice config edits.
+        wait = CONFIG_POLL_SECONDS if next_run is None else min(CONFIG_POLL_SECONDS, next_run - now)
+        time.sleep(max(1.0, wait))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Medusa background refresher")
+    parser.add_argument("--loop", action="store_true",
+                        help="stay resident and refresh queries as they become due")
+    parser.add_argument("--profile", action="store_true",
+                        help="dump cProfile stats for every download run")
+    args = parser.parse_args(argv)
+
+    lock = acquire_lock()
+    if lock is None:
+        print("Another Medusa daemon is already running. Exiting.")
+        return 1
+    try:
+        if args.loop:
+            run_forever(args.profile)
+        else:
+            run_once(args.profile)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lock.close()
+    return 0
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,10 +1,25 @@
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
-from PIL import Image
 import threading
+import contextlib
 import os
 import platform
-from medusa_core import load_config, save_config, run_downloads, DEFAULT_WALLDIR
+from medusa_config import load_config, save_config, DEFAULT_WALLDIR
+from medusa_index import get_index
+from medusa_catalog import get_catalog
+from medusa_metrics import last_run, format_summary
+from medusa_thumbs import THUMB_SIZE, ThumbnailLoader, prune_thumbnails, remove_thumbnails
+from medusa_retention import mark_used
+from medusa_rotation import Rotator, rotation_options
+
+# Gallery grid geometry; every row has the same height so the visible
+# range can be computed from the scroll offset alone.
+COLUMNS = 3
+TILE_PAD = 6
+COL_W = THUMB_SIZE[0] + 2 * TILE_PAD
+ROW_H = THUMB_SIZE[1] + 56
+GALLERY_PAGE = 120          # catalog rows fetched per query while scrolling
+ALL = "All"
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("green")
@@ -17,6 +32,8 @@ class MedusaApp(ctk.CTk):
 
         self.cfg = load_config()
         self.query_rows = []
+        self.rotator = None
+        self._rotation_job = None
 
         self.build_ui()
 
@@ -30,7 +47,14 @@ class MedusaApp(ctk.CTk):
         self.settings_tab = self.tabs.tab("Settings")
 
         self.build_home_tab()
+        # The settings tab and the gallery contents aren't needed for the
+        # first frame; build them once the window is on screen.
+        self.after_idle(self.after, 0, self._finish_startup)
+
+    def _finish_startup(self):
         self.build_settings_tab()
+        self.load_gallery()
+        self._setup_rotation()
 
     # ==================== HOME TAB ====================
     def build_home_tab(self):
@@ -41,6 +65,10 @@ class MedusaApp(ctk.CTk):
         self.progress_var = ctk.DoubleVar(value=0)
         self.progress_bar = ctk.CTkProgressBar(top_frame, variable=self.progress_var)
         self.progress_bar.pack(fill="x", expand=True, side="left", padx=8)
+        self.next_btn = ctk.CTkButton(top_frame, text="NEXT WALLPAPER", command=self.rotate_now, width=160)
+        self.next_btn.pack(side="left", padx=8)
+        self.status_var = ctk.StringVar(value="")
+        ctk.CTkLabel(self.home_tab, textvariable=self.status_var, anchor="w").pack(fill="x", padx=16)
 
         self.query_container = ctk.CTkFrame(self.home_tab)
         self.query_container.pack(fill="x", padx=8, pady=6)
@@ -53,11 +81,41 @@ class MedusaApp(ctk.CTk):
         for q in self.cfg.get("queries", []):
             self.add_query_row(q.get("query", ""), str(q.get("count",1)), q.get("api", "Pexels"))
 
-        gallery_wrap = ctk.CTkFrame(self.home_tab, fg_color="transparent")
+        filter_row = ctk.CTkFrame(self.home_tab, fg_color="transparent")
+        filter_row.pack(fill="x", padx=16)
+        ctk.CTkLabel(filter_row, text="Source").pack(side="left")
+        self.source_filter = ctk.CTkOptionMenu(filter_row, values=[ALL], width=140,
+                                               command=lambda _: self._refresh_gallery(rewind=True))
+        self.source_filter.pack(side="left", padx=(4, 16))
+        ctk.CTkLabel(filter_row, text="Query").pack(side="left")
+        self.query_filter = ctk.CTkOptionMenu(filter_row, values=[ALL], width=260,
+                                              command=lambda _: self._refresh_gallery(rewind=True))
+        self.query_filter.pack(side="left", padx=4)
+        self.gallery_count_var = ctk.StringVar(value="")
+        ctk.CTkLabel(filter_row, textvariable=self.gallery_count_var).pack(side="right")
+
+        # Virtualized gallery: a plain canvas sized for every row, with tile
+        # widgets only for the rows currently in view.
+        gallery_wrap = ctk.CTkFrame(self.home_tab, corner_radius=12)
         gallery_wrap.pack(fill="both", expand=True, padx=8, pady=8)
-        self.gallery_canvas = ctk.CTkScrollableFrame(gallery_wrap, corner_radius=12)
-        self.gallery_canvas.pack(fill="both", expand=True)
-        self.load_gallery()
+        bg = self._apply_appearance_mode(gallery_wrap.cget("fg_color"))
+        self.gallery_canvas = ctk.CTkCanvas(gallery_wrap, bg=bg, highlightthickness=0,
+                                            yscrollincrement=ROW_H // 4)
+        self.gallery_scroll = ctk.CTkScrollbar(gallery_wrap, command=self.gallery_canvas.yview)
+        self.gallery_canvas.configure(yscrollcommand=self._on_gallery_scroll)
+        self.gallery_scroll.pack(side="right", fill="y", padx=(0, 4), pady=8)
+        self.gallery_canvas.pack(fill="both", expand=True, padx=8, pady=8)
+        self.gallery_canvas.bind("<Configure>", lambda e: self._layout_gallery())
+        self.bind_all("<MouseWheel>", self._on_gallery_wheel, add="+")
+        self.bind_all("<Button-4>", self._on_gallery_wheel, add="+")
+        self.bind_all("<Button-5>", self._on_gallery_wheel, add="+")
+
+        self.gallery_count = 0      # files matching the current filter
+        self.gallery_pages = {}     # page number -> paths, newest first, from the catalog
+        self.gallery_tiles = {}     # path -> (canvas window id, frame, image button) for visible tiles
+        self._render_pending = False
+        self.thumb_loader = ThumbnailLoader(
+            lambda p, img: self.after(0, self._on_thumb_ready, p, img))
 
     def add_query_row(self, query="", count="1", api="Pexels"):
         row = ctk.CTkFrame(self.query_rows_frame, fg_color="transparent")
@@ -87,74 +145,235 @@ class MedusaApp(ctk.CTk):
         threading.Thread(target=self._download_thread, daemon=True).start()
 
     def _download_thread(self):
-        total_images = sum(int(cv.get()) for (_, _, cv, _) in self.query_rows)
-        downloaded_count = 0
+        from medusa_core import iter_downloads   # the download stack loads on first use
+        total_images = max(1, sum(int(cv.get()) for (_, _, cv, _) in self.query_rows))
+        done = 0
+        staged = bool(self.cfg.get("nuke", False))
+        if staged:
+            # A nuking run only reports its images once the new library is swapped in.
+            self.after(0, self._progress_busy, True)
+        saved = []
+        # One run at a time: a refill running next to this one would write into
+        # a library this run may be about to swap out.
+        paused = self.rotator.paused() if self.rotator else contextlib.nullcontext()
+        try:
+            with paused:
+                for result in iter_downloads(self.cfg):
+                    done += 1
+                    fraction = min(1.0, done / total_images)
+                    self.after(0, lambda f=fraction: self.progress_var.set(f))
+                    if result["path"]:
+                        saved.append(result)
+                        self.after(0, lambda p=result["path"]: self.add_thumb(p))
+                if staged and saved and self.rotator:
+                    # The swap took the queued wallpapers with the old library.
+                    self.rotator.library_replaced(saved)
+        finally:
+            if staged:
+                self.after(0, self._progress_busy, False)
+            self.after(0, lambda: self.progress_var.set(1.0))
+        summary = format_summary(last_run())
+        self.after(0, lambda: self.status_var.set(f"Last run: {summary}"))
+        # A staged run swaps the whole folder and retention may have evicted
+        # files, so rebuild from what is on disk now.
+        self.after(0, self.load_gallery)
+
+    def _progress_busy(self, busy):
+        if busy:
+            self.progress_bar.configure(mode="indeterminate")
+            self.progress_bar.start()
+        else:
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate")
 
-        def show_progress(path):
-            nonlocal downloaded_count
-            downloaded_count += 1
-            self.after(0, lambda: self.progress_var.set(downloaded_count/total_images))
-            self.after(0, lambda: self.add_thumb(path))
+    def load_gallery(self):
+        """Rebuild the gallery from wall_dir's catalog (start-up and folder changes)."""
+        self.thumb_loader.clear()
+        for win, frame, _ in self.gallery_tiles.values():
+            self.gallery_canvas.delete(win)
+            frame.destroy()
+        self.gallery_tiles.clear()
+        self.source_filter.set(ALL)
+        self.query_filter.set(ALL)
+        self._refresh_gallery(rewind=True)
+
+        # Catch up with files added or removed outside Medusa, off the UI thread.
+        wall_dir = self.cfg.get("wall_dir", DEFAULT_WALLDIR)
+        threading.Thread(target=self._reconcile_gallery, args=(wall_dir,), daemon=True).start()
 
-        run_downloads(self.cfg, show_progress=show_progress)
+    def _reconcile_gallery(self, wall_dir):
+        try:
+            changed = any(get_catalog(wall_dir).reconcile())
+        except Exception as e:
+            print(f"[Medusa] catalog error: {e}")
+            changed = False
+        prune_thumbnails(wall_dir)
+        if changed:
+            self.after(0, self._refresh_gallery)
+
+    def _catalog(self):
+        try:
+            return get_catalog(self.cfg.get("wall_dir", DEFAULT_WALLDIR))
+        except Exception:
+            return None
 
-    def load_gallery(self):
-        # Clear previous widgets
-        for w in self.gallery_canvas.winfo_children():
-            w.destroy()
+    def _gallery_filter(self):
+        source, query = self.source_filter.get(), self.query_filter.get()
+        return {"provider": None if source == ALL else source,
+                "query": None if query == ALL else query}
 
-        wall_dir = self.cfg.get("wall_dir", DEFAULT_WALLDIR)
+    def _refresh_gallery(self, rewind=False):
+        """Re-read count and filter choices from the catalog; visible tiles are kept."""
+        catalog = self._catalog()
+        self.gallery_pages.clear()
         try:
-            files = sorted([os.path.join(wall_dir, f) for f in os.listdir(wall_dir)], reverse=True)
+            self.gallery_count = catalog.count(**self._gallery_filter()) if catalog else 0
+            self.source_filter.configure(values=[ALL] + catalog.values("provider"))
+            self.query_filter.configure(values=[ALL] + catalog.values("query"))
         except Exception:
-            files = []
+            self.gallery_count = 0
+        self.gallery_count_var.set(f"{self.gallery_count} wallpapers")
+        if rewind:
+            self.gallery_canvas.yview_moveto(0)
+        self._layout_gallery()
+
+    def _path_at(self, i):
+        page, pos = divmod(i, GALLERY_PAGE)
+        paths = self.gallery_pages.get(page)
+        if paths is None:
+            catalog = self._catalog()
+            try:
+                paths = catalog.page(page * GALLERY_PAGE, GALLERY_PAGE, **self._gallery_filter()) if catalog else []
+            except Exception:
+                paths = []
+            self.gallery_pages[page] = paths
+        return paths[pos] if pos < len(paths) else None
 
-        col, r = 0, 0
-        for p in files:
+    def _layout_gallery(self):
+        rows = -(-self.gallery_count // COLUMNS)
+        width = max(self.gallery_canvas.winfo_width(), COLUMNS * COL_W)
+        self.gallery_canvas.configure(scrollregion=(0, 0, width, max(rows * ROW_H, 1)))
+        self._schedule_render()
+
+    def _on_gallery_scroll(self, first, last):
+        self.gallery_scroll.set(first, last)
+        self._schedule_render()
+
+    def _on_gallery_wheel(self, event):
+        try:
+            w = self.winfo_containing(event.x_root, event.y_root)
+        except Exception:
+            return
+        while w is not None and w is not self.gallery_canvas:
+            w = getattr(w, "master", None)
+        if w is None:
+            return
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.gallery_canvas.yview_scroll(-1, "units")
+        else:
+            self.gallery_canvas.yview_scroll(1, "units")
+
+    def _schedule_render(self):
+        # Scroll events arrive in bursts; render once per idle cycle.
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render_visible)
+
+    def _render_visible(self):
+        self._render_pending = False
+        top = self.gallery_canvas.canvasy(0)
+        height = self.gallery_canvas.winfo_height()
+        # One extra row above and below keeps short scrolls from showing gaps.
+        first_row = max(0, int(top // ROW_H) - 1)
+        last_row = int((top + height) // ROW_H) + 1
+        start = first_row * COLUMNS
+        end = min(self.gallery_count, (last_row + 1) * COLUMNS)
+        wanted = {}
+        for i in range(start, end):
+            p = self._path_at(i)
+            if p is not None:
+                wanted[p] = i
+        on_screen = range(int(top // ROW_H) * COLUMNS, int((top + height) // ROW_H + 1) * COLUMNS)
+
+        for p in [p for p in self.gallery_tiles if p not in wanted]:
+            win, frame, _ = self.gallery_tiles.pop(p)
+            self.thumb_loader.cancel(p)
+            self.gallery_canvas.delete(win)
+            frame.destroy()
+
+        for p, i in wanted.items():
+            x = (i % COLUMNS) * COL_W + TILE_PAD
+            y = (i // COLUMNS) * ROW_H + TILE_PAD
+            tile = self.gallery_tiles.get(p)
+            if tile is None:
+                self.gallery_tiles[p] = self._make_tile(p, x, y)
+                # Tiles actually on screen decode before the slack rows.
+                self.thumb_loader.request(p, priority=i if i in on_screen else self.gallery_count + i)
+            else:
+                self.gallery_canvas.coords(tile[0], x, y)
+
+    def _make_tile(self, p, x, y):
+        # Frame wraps image + delete button; the image arrives later from
+        # the thumbnail loader (see _on_thumb_ready).
+        frame = ctk.CTkFrame(self.gallery_canvas, corner_radius=12)
+
+        # Image button: click to set wallpaper
+        btn = ctk.CTkButton(
+            frame,
+            text="",
+            width=THUMB_SIZE[0],
+            height=THUMB_SIZE[1],
+            corner_radius=12,
+            command=lambda pp=p: self.set_wallpaper(pp)
+        )
+        btn.pack()
+
+        # Delete button
+        del_btn = ctk.CTkButton(
+            frame,
+            text="🗑 Delete",
+            fg_color="#b91c1c",
+            hover_color="#ef4444",
+            command=lambda pp=p: self.delete_image(pp)
+        )
+        del_btn.pack(pady=4)
+
+        win = self.gallery_canvas.create_window(x, y, window=frame, anchor="nw")
+        return win, frame, btn
+
+    def _on_thumb_ready(self, path, img):
+        tile = self.gallery_tiles.get(path)
+        if tile is None:
+            return  # scrolled away or gallery reloaded meanwhile
+        if img is None:
+            # Unreadable file: hide it from the gallery.
             try:
-                img = Image.open(p)
-                img.thumbnail((360, 240))
-                ctk_img = ctk.CTkImage(light_image=img, dark_image=img, size=(360, 240))
-
-                # Frame wraps image + delete button
-                frame = ctk.CTkFrame(self.gallery_canvas, corner_radius=12)
-                frame.grid(row=r, column=col, padx=6, pady=6)
-
-                # Image button: click to set wallpaper
-                btn = ctk.CTkButton(
-                    frame,
-                    image=ctk_img,
-                    text="",
-                    width=360,
-                    height=240,
-                    corner_radius=12,
-                    command=lambda pp=p: self.set_wallpaper(pp)
-                )
-                btn.image = ctk_img
-                btn.pack()
-
-                # Delete button
-                del_btn = ctk.CTkButton(
-                    frame,
-                    text="🗑 Delete",
-                    fg_color="#b91c1c",
-                    hover_color="#ef4444",
-                    command=lambda pp=p, fr=frame: self.delete_image(pp, fr)
-                )
-                del_btn.pack(pady=4)
-
-                col += 1
-                if col >= 3:
-                    col = 0
-                    r += 1
+                get_catalog(os.path.dirname(path)).mark_unreadable(path)
             except Exception:
                 pass
-
+            self.remove_thumb(path)
+            return
+        ctk_img = ctk.CTkImage(light_image=img, dark_image=img, size=THUMB_SIZE)
+        tile[2].configure(image=ctk_img)
+        tile[2].image = ctk_img
 
     def add_thumb(self, path):
-        self.load_gallery()
+        """Show one newly downloaded file; save_image already put it in the catalog."""
+        wall_dir = os.path.normpath(self.cfg.get("wall_dir", DEFAULT_WALLDIR))
+        if os.path.normpath(os.path.dirname(path)) != wall_dir:
+            return
+        self._refresh_gallery()
+
+    def remove_thumb(self, path):
+        tile = self.gallery_tiles.pop(path, None)
+        self.thumb_loader.cancel(path)
+        if tile:
+            self.gallery_canvas.delete(tile[0])
+            tile[1].destroy()
+        self._refresh_gallery()
 
     def set_wallpaper(self, path):
+        mark_used(path)
         system = platform.system()
         if system == "Windows":
             import ctypes
@@ -164,12 +383,51 @@ class MedusaApp(ctk.CTk):
         else:
             os.system(f"gsettings set org.gnome.desktop.background picture-uri 'file://{path}'")
     
-    def delete_image(self, path, frame):
+    # ==================== ROTATION ====================
+    def _setup_rotation(self):
+        """Start, stop or re-time wallpaper rotation to match the settings."""
+        opts = rotation_options(self.cfg)
+        if self._rotation_job is not None:
+            self.after_cancel(self._rotation_job)
+            self._rotation_job = None
+        if not opts["enabled"]:
+            if self.rotator:
+                self.rotator.stop()
+            return
+        if self.rotator is None:
+            self.rotator = Rotator(self.cfg, self.set_wallpaper)
+        else:
+            self.rotator.configure(self.cfg)
+        self.rotator.start()
+        self._rotation_job = self.after(int(self.rotator.interval_seconds() * 1000), self._rotate_on_schedule)
+
+    def _rotate_on_schedule(self):
+        self._rotation_job = None
+        self.rotate_now()
+
+    def rotate_now(self):
+        # The buffer is filled in the background, so this is only a file switch.
+        if self.rotator is None:
+            self.rotator = Rotator(self.cfg, self.set_wallpaper)
+        self.rotator.start()
+        path = self.rotator.next()
+        ready, target = self.rotator.status()
+        self.status_var.set(f"Wallpaper: {os.path.basename(path) if path else 'none yet'} "
+                            f"({ready}/{target} queued)")
+        if rotation_options(self.cfg)["enabled"]:
+            if self._rotation_job is not None:
+                self.after_cancel(self._rotation_job)
+            self._rotation_job = self.after(int(self.rotator.interval_seconds() * 1000), self._rotate_on_schedule)
+
+    def delete_image(self, path):
     # Confirmation popup
         if messagebox.askyesno("Delete Image", f"Delete '{os.path.basename(path)}'?"):
             try:
                 os.remove(path)        # remove file from disk
-                frame.destroy()        # remove frame from GUI
+                get_index(os.path.dirname(path)).remove(path)
+                get_catalog(os.path.dirname(path)).remove(path)
+                remove_thumbnails(path)
+                self.remove_thumb(path)   # remove tile from GUI
                 print(f"[Medusa] Deleted {path}")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to delete image:\n{e}")
@@ -210,6 +468,18 @@ class MedusaApp(ctk.CTk):
         ctk.CTkLabel(row, text="hours").pack(side="left")
         ctk.CTkCheckBox(auto_frame, text="Preserve Pictures on Auto Refresh", variable=self.preserve_var).pack(anchor="w", padx=8, pady=4)
 
+        rotation = rotation_options(self.cfg)
+        rotate_frame = ctk.CTkFrame(self.settings_tab, corner_radius=12)
+        rotate_frame.pack(fill="x", **pad)
+        self.rotate_var = ctk.BooleanVar(value=rotation["enabled"])
+        self.rotate_minutes_var = ctk.StringVar(value=str(rotation["interval_minutes"]))
+        ctk.CTkCheckBox(rotate_frame, text="Rotate Wallpaper", variable=self.rotate_var).pack(anchor="w", padx=8, pady=4)
+        row = ctk.CTkFrame(rotate_frame, fg_color="transparent")
+        row.pack(anchor="w", padx=8, pady=4)
+        ctk.CTkLabel(row, text="Every").pack(side="left")
+        ctk.CTkEntry(row, textvariable=self.rotate_minutes_var, width=70).pack(side="left", padx=4)
+        ctk.CTkLabel(row, text="minutes").pack(side="left")
+
         ctk.CTkButton(self.settings_tab, text="Save Settings", command=self.save_settings, width=160).pack(padx=12, pady=12, anchor="e")
 
     def change_folder(self):
@@ -217,6 +487,7 @@ class MedusaApp(ctk.CTk):
         if path:
             self.wall_dir_var.set(path)
             self.cfg["wall_dir"] = path
+            self.load_gallery()
 
     def save_settings(self):
         self.cfg["wall_dir"] = self.wall_dir_var.get()
@@ -234,7 +505,15 @@ class MedusaApp(ctk.CTk):
             self.cfg["refresh_hours"] = float(self.refresh_var.get())
         except Exception:
             self.cfg["refresh_hours"] = 24.0
+        rotation = dict(self.cfg.get("rotation") or {})
+        rotation["enabled"] = self.rotate_var.get()
+        try:
+            rotation["interval_minutes"] = float(self.rotate_minutes_var.get())
+        except Exception:
+            rotation["interval_minutes"] = 30
+        self.cfg["rotation"] = rotation
         save_config(self.cfg)
+        self._setup_rotation()
         messagebox.showinfo("Medusa","Settings saved")
 
 if __name__ == "__main__":
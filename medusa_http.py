@@ -0,0 +1,101 @@
+# medusa_http.py
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from medusa_config import HTTP_DEFAULTS
+
+_lock = threading.Lock()
+_session = None
+_settings = None
+_stats = {"opened": 0, "checkouts": 0}
+
+
+class _CountingMixin:
+    # Every request checks a connection out of the pool; only some of them
+    # have to open a new socket. The difference is the keep-alive reuse.
+    def _new_conn(self):
+        with _lock:
+            _stats["opened"] += 1
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        with _lock:
+            _stats["checkouts"] += 1
+        return super()._get_conn(timeout=timeout)
+
+
+class _CountingHTTPPool(_CountingMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSPool(_CountingMixin, HTTPSConnectionPool):
+    pass
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPPool,
+            "https": _CountingHTTPSPool
+        }
+
+
+def _build_session(settings):
+    retry = Retry(
+        total=settings["retries"],
+        connect=settings["retries"],
+        read=settings["retries"],
+        status=settings["retries"],
+        backoff_factor=settings["backoff"],
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD", "POST"]),
+        raise_on_status=False
+    )
+    adapter = _PooledAdapter(
+        pool_connections=settings["pool_size"],
+        pool_maxsize=settings["pool_size"],
+        max_retries=retry
+    )
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def configure_http(pool_size=None, retries=None, backoff=None):
+    """Apply pool/retry settings; the shared session is rebuilt only if they change."""
+    global _session, _settings
+    settings = dict(_settings or HTTP_DEFAULTS)
+    for k, v in (("pool_size", pool_size), ("retries", retries), ("backoff", backoff)):
+        if v is not None:
+            settings[k] = v
+    settings["pool_size"] = max(1, int(settings["pool_size"]))
+    settings["retries"] = max(0, int(settings["retries"]))
+    settings["backoff"] = max(0.0, float(settings["backoff"]))
+    with _lock:
+        if settings == _settings and _session is not None:
+            return
+        old, _session, _settings = _session, _build_session(settings), settings
+    if old is not None:
+        old.close()
+
+
+def configure_from_config(cfg):
+    http = cfg.get("http") or {}
+    configure_http(http.get("pool_size"), http.get("retries"), http.get("backoff"))
+
+
+def get_session():
+    """Return the process-wide keep-alive session shared by all Medusa modules."""
+    if _session is None:
+        configure_http()
+    return _session
+
+
+def http_stats():
+    with _lock:
+        opened, checkouts = _stats["opened"], _stats["checkouts"]
+    return {"requests": checkouts, "opened": opened, "reused": max(0, checkouts - opened)}
@@ -0,0 +1,128 @@
+# medusa_httpcache.py
+import time
+import hashlib
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+from medusa_cache import TTLCache
+from medusa_ratelimit import limited_request
+
+# Stored responses outlive their freshness so they can still be revalidated
+# with If-None-Match / If-Modified-Since; the TTL only bounds disk use.
+RESPONSE_CACHE = TTLCache("api_responses", ttl=7 * 24 * 3600, max_entries=64)
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires", "Date")
+
+_stats_lock = threading.Lock()
+_stats = {"fresh": 0, "revalidated": 0, "fetched": 0}
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def _http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except Exception:
+        return None
+
+
+def _cache_control(headers):
+    directives = {}
+    for part in (headers.get("Cache-Control") or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def _fresh_until(headers, now):
+    """Expiry time the response allows, now if it must be revalidated, None if it can't be stored."""
+    cc = _cache_control(headers)
+    if "no-store" in cc:
+        return None
+    if "no-cache" in cc:
+        return now
+    if "max-age" in cc:
+        try:
+            age = float(headers.get("Age") or 0)
+            return now + max(0.0, float(cc["max-age"]) - age)
+        except ValueError:
+            return now
+    expires = _http_date(headers.get("Expires"))
+    if expires is not None:
+        date = _http_date(headers.get("Date")) or now
+        return now + max(0.0, expires - date)
+    return now
+
+
+def _key(url, params, headers=None):
+    # Keyed by the credential too (hashed, so it isn't written to disk), so a
+    # response fetched under one API key is never served under another.
+    key = f"{url}?{urlencode(sorted((params or {}).items()))}"
+    auth = (headers or {}).get("Authorization")
+    if auth:
+        key += "#" + hashlib.sha256(auth.encode("utf-8")).hexdigest()[:16]
+    return key
+
+
+def _from_cache(entry, url):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = entry["body"].encode("utf-8")
+    resp.encoding = "utf-8"
+    resp.headers = CaseInsensitiveDict(entry["headers"])
+    resp.url = url
+    return resp
+
+
+def _store(key, resp, now, entry=None):
+    fresh = _fresh_until(resp.headers, now)
+    headers = dict(entry["headers"]) if entry else {}
+    headers.update({h: resp.headers[h] for h in KEPT_HEADERS if h in resp.headers})
+    if fresh is None or (fresh <= now and "ETag" not in headers and "Last-Modified" not in headers):
+        # Nothing to reuse or revalidate next time.
+        RESPONSE_CACHE.pop(key)
+        return
+    body = entry["body"] if entry else resp.text
+    RESPONSE_CACHE.set(key, {"fresh_until": fresh, "headers": headers, "body": body})
+
+
+def cached_get(name, url, params=None, headers=None, timeout=10):
+    """GET an API endpoint through `name`'s rate limiter and the local HTTP cache.
+
+    Fresh responses are served without a request; stale ones are revalidated
+    conditionally and a 304 reuses the stored body. Only for requests whose
+    answer doesn't change from call to call (not random endpoints).
+    """
+    key = _key(url, params, headers)
+    now = time.time()
+    entry = RESPONSE_CACHE.get(key)
+    if entry and entry["fresh_until"] > now:
+        _count("fresh")
+        return _from_cache(entry, url)
+    headers = dict(headers or {})
+    if entry:
+        if "ETag" in entry["headers"]:
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if "Last-Modified" in entry["headers"]:
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+    resp = limited_request(name, "GET", url, params=params, headers=headers, timeout=timeout)
+    if resp.status_code == 304 and entry:
+        _store(key, resp, now, entry)
+        resp.close()
+        _count("revalidated")
+        return _from_cache(entry, url)
+    _count("fetched")
+    if resp.status_code == 200:
+        _store(key, resp, now)
+    return resp
+
+
+def cache_stats():
+    """Responses served fresh from cache, revalidated with a 304, or fetched in full."""
+    with _stats_lock:
+        return dict(_stats, size=RESPONSE_CACHE.stats()["size"])
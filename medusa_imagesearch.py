@@ -1,6 +1,16 @@
 # medusa_imagesearch.py
-import requests, random, re
-from bs4 import BeautifulSoup
+import random, re, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+from medusa_ratelimit import limited_request
+from medusa_cache import TTLCache
+import medusa_metrics as metrics
+try:
+    from lxml import etree
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
@@ -12,26 +22,45 @@ FALLBACK_SITES = [
     "https://www.wallpaperflare.com/search?wallpaper={query}"
 ]
 
+DDG_URL = "https://duckduckgo.com/"
+PAGE_CHUNK = 32 * 1024
+MAX_PAGES_PER_CALL = 3
 
-def get_imagesearch_results(query, count=1):
-    """Fetch high-quality wallpaper images using DuckDuckGo (with fallback)."""
-    urls = []
+# vqd tokens are keyed by query; result pages by "<source>|<query>" and hold
+# the candidates not handed out yet plus DuckDuckGo's `next` page link.
+VQD_CACHE = TTLCache("vqd", ttl=30 * 60, max_entries=256)
+RESULTS_CACHE = TTLCache("imagesearch_results", ttl=6 * 3600, max_entries=512)
 
-    # --- 1️⃣ Try DuckDuckGo image search ---
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+def _key_lock(key):
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def cache_stats():
+    return {"vqd": VQD_CACHE.stats(), "results": RESULTS_CACHE.stats()}
 
-        # Step 1: Get vqd token
-        # --- Improved vqd token extraction ---
+
+def _get_vqd(query):
+    """Scrape the per-query vqd token DuckDuckGo requires for i.js."""
+    vqd = VQD_CACHE.get(query)
+    if vqd:
+        return vqd
     try:
-        resp = requests.post(
-            "https://duckduckgo.com/",
-            data={"q": query},
-            headers={
-                "User-Agent": HEADERS["User-Agent"],
-                "Referer": "https://duckduckgo.com/"
-            },
-            timeout=10
-        )
-        text = resp.text
+        with metrics.timer("vqd", "ImageSearch"):
+            resp = limited_request(
+                "ImageSearch", "POST", DDG_URL,
+                data={"q": query},
+                headers={
+                    "User-Agent": HEADERS["User-Agent"],
+                    "Referer": "https://duckduckgo.com/"
+                },
+                timeout=10
+            )
+            text = resp.text
 
         # Try multiple regex formats (DuckDuckGo changes often)
         match = re.search(r"vqd='([0-9\-]+)'", text)
@@ -39,64 +68,260 @@ def get_imagesearch_results(query, count=1):
             match = re.search(r"vqd=([0-9\-]+)\&", text)
         if not match:
             print("[ImageSearch] Could not extract vqd token from DuckDuckGo HTML")
-            return []
-        else:
-            vqd = match.group(1)
+            metrics.failure("ImageSearch", "vqd_missing")
+            return None
+        VQD_CACHE.set(query, match.group(1))
+        return match.group(1)
     except Exception as e:
+        metrics.failure("ImageSearch", e)
         print(f"[ImageSearch] Token fetch error: {e}")
-        return []
+        return None
+
 
+def _filter_ddg_results(results):
+    urls = []
+    for img in results:
+        url = img.get("image")
+        if not url:
+            continue
+
+        # Filter: only keep large / wallpaper-like images
+        title = img.get("title", "").lower()
+        if any(x in url.lower() for x in ["thumb", "icon", "logo", "small"]):
+            continue
+        if any(x in title for x in ["icon", "logo", "sticker"]):
+            continue
+        if any(k in url.lower() for k in ["wallpaper", "1920", "4k", "1080", "background", "wide"]):
+            urls.append(url)
+    return urls
 
-            # Step 2: Fetch image results as JSON
-        res = requests.get(
-            "https://duckduckgo.com/i.js",
-            params={"l": "us-en", "o": "json", "q": query, "vqd": vqd},
-            headers=HEADERS,
-            timeout=10
-        )
+
+def _ddg_page(query, next_link):
+    """Fetch one i.js page; returns (filtered urls, next link or None)."""
+    vqd = _get_vqd(query)
+    if not vqd:
+        raise ValueError("no vqd token")
+    with metrics.timer("ddg_page", "ImageSearch"):
+        if next_link:
+            res = limited_request("ImageSearch", "GET", urljoin(DDG_URL, next_link),
+                                  headers=HEADERS, timeout=10)
+        else:
+            res = limited_request(
+                "ImageSearch", "GET", urljoin(DDG_URL, "i.js"),
+                params={"l": "us-en", "o": "json", "q": query, "vqd": vqd},
+                headers=HEADERS,
+                timeout=10
+            )
+        if res.status_code == 403:
+            # Stale token: drop it so the next attempt scrapes a fresh one.
+            VQD_CACHE.pop(query)
+        res.raise_for_status()
         data = res.json()
-        for img in data.get("results", []):
-            url = img.get("image")
-            if not url:
-                continue
+    return _filter_ddg_results(data.get("results", [])), data.get("next")
+
+
+def _largest_srcset(srcset):
+    """URL of the biggest candidate in a srcset ("a.jpg 640w, b.jpg 1920w" -> b.jpg)."""
+    best, best_size = None, -1.0
+    for part in srcset.split(","):
+        bits = part.split()
+        if not bits:
+            continue
+        size = 1.0
+        if len(bits) > 1 and bits[1][:-1].replace(".", "", 1).isdigit():
+            size = float(bits[1][:-1])
+            if bits[1].endswith("x"):
+                size *= 10000  # density descriptors: rank above any plain width
+        if size > best_size:
+            best, best_size = bits[0], size
+    return best
+
+
+def _wallpaper_like(url):
+    # Prefer large / wallpaper-related URLs
+    if url.split("?")[0].endswith(".svg"):
+        return False
+    return any(k in url.lower() for k in ["wallpaper", "1920", "1080", "4k", "wide"])
+
+
+def _pick_img_url(attrs, wanted=None):
+    # Largest srcset variant first, then the lazy-load source, then src; the
+    # first one `wanted` accepts wins, so a thumbnail-only srcset doesn't hide
+    # a good src.
+    candidates = [_largest_srcset(attrs[name]) for name in ("srcset", "data-srcset") if attrs.get(name)]
+    candidates += [attrs.get("data-src"), attrs.get("src")]
+    for url in candidates:
+        if url and url.startswith("http") and (wanted is None or wanted(url)):
+            return url
+    return None
+
+
+class _ImgCollector:
+    """Parser target that keeps only <img> attributes; no tree is built."""
+
+    def __init__(self, wanted=None):
+        self.urls = []
+        self.wanted = wanted
+
+    def start(self, tag, attrib):
+        if tag == "img":
+            url = _pick_img_url(attrib, self.wanted)
+            if url:
+                self.urls.append(url)
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self.urls
+
 
-                # Filter: only keep large / wallpaper-like images
-                title = img.get("title", "").lower()
-                if any(x in url.lower() for x in ["thumb", "icon", "logo", "small"]):
-                    continue
-                if any(x in title for x in ["icon", "logo", "sticker"]):
-                    continue
-                if any(k in url.lower() for k in ["wallpaper", "1920", "4k", "1080", "background", "wide"]):
-                    urls.append(url)
+class _StdlibImgCollector(HTMLParser):
+    # Used only when lxml is not installed.
+    def __init__(self, target):
+        super().__init__()
+        self.target = target
 
-            urls = list(dict.fromkeys(urls))  # dedupe
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+
+
+def extract_image_urls(chunks, wanted=None):
+    """Feed HTML byte chunks through a streaming parser and return the img URLs found.
+
+    `wanted`, if given, is a predicate each tag's candidate URLs are tried
+    against in order of preference.
+    """
+    target = _ImgCollector(wanted)
+    parser = etree.HTMLParser(target=target) if HAS_LXML else _StdlibImgCollector(target)
+    for chunk in chunks:
+        if not HAS_LXML and isinstance(chunk, bytes):
+            chunk = chunk.decode("utf-8", "replace")
+        parser.feed(chunk)
+    try:
+        parser.close()
+    except Exception:
+        pass  # empty or truncated page; keep whatever was found
+    return target.urls
+
+
+def _site_page(base):
+    def fetch(query, next_link):
+        with metrics.timer("fallback", "ImageSearch"):
+            url = base.format(query=query.replace(" ", "+"))
+            with limited_request(urlparse(url).netloc, "GET", url,
+                                 headers=HEADERS, timeout=10, stream=True) as resp:
+                resp.raise_for_status()
+                # Parse while the page is still arriving.
+                imgs = extract_image_urls(resp.iter_content(PAGE_CHUNK), _wallpaper_like)
+        return imgs, None
+    return fetch
+
+
+def _site_key(base):
+    parsed = urlparse(base)
+    return parsed.netloc + parsed.path
+
+
+def _take_candidates(source, query, count, fetch_page):
+    """Hand out up to `count` cached candidates for (source, query), paging in more as needed.
+
+    Candidates are consumed as they are served, so repeated calls walk
+    further down the result list instead of refetching page one.
+    """
+    key = f"{source}|{query}"
+    with _key_lock(key):
+        entry = RESULTS_CACHE.get(key)
+        cached = entry is not None
+        if entry is None:
+            entry = {"urls": [], "next": ""}  # "" = first page not fetched yet
+        pages = 0
+        while len(entry["urls"]) < count and entry["next"] is not None and pages < MAX_PAGES_PER_CALL:
+            try:
+                urls, next_link = fetch_page(query, entry["next"])
+            except Exception as e:
+                metrics.failure("ImageSearch", e)
+                print(f"[ImageSearch] {source} error: {e}")
+                break
+            pages += 1
+            urls = [u for u in dict.fromkeys(urls) if u not in entry["urls"]]
             random.shuffle(urls)
-            if len(urls) >= count:
-                return urls[:count]
-    except Exception as e:
-        print(f"[ImageSearch] DuckDuckGo error: {e}")
+            entry["urls"].extend(urls)
+            entry["next"] = next_link or None
+        taken, entry["urls"] = entry["urls"][:count], entry["urls"][count:]
+        if pages or taken:
+            RESULTS_CACHE.set(key, entry, keep_expiry=cached)
+        return taken
 
-    # --- 2️⃣ Fallback: scrape wallpaper sites if DDG fails ---
+
+def _return_candidates(source, query, urls):
+    """Put unused candidates back at the front of their cached list."""
+    if not urls:
+        return
+    key = f"{source}|{query}"
+    with _key_lock(key):
+        entry = RESULTS_CACHE.get(key)
+        if entry is not None:
+            entry["urls"] = urls + [u for u in entry["urls"] if u not in urls]
+            RESULTS_CACHE.set(key, entry, keep_expiry=True)
+
+
+def _fallback_results(query, count, exclude=()):
+    """Query every fallback site at once and stop as soon as `count` URLs are in hand.
+
+    Sites that answer after that still fill the cache in the background;
+    surplus candidates, including everything the late sites took, go back
+    into it for the next call.
+    """
+    urls = []
+    seen = set(exclude)
+    pool = ThreadPoolExecutor(max_workers=len(FALLBACK_SITES) or 1)
+    futures = {}
     try:
-        for base in random.sample(FALLBACK_SITES, len(FALLBACK_SITES)):
+        futures = {pool.submit(metrics.bind(_take_candidates), _site_key(base), query, count, _site_page(base)): _site_key(base)
+                   for base in FALLBACK_SITES}
+        for fut in as_completed(futures):
+            source = futures.pop(fut)
             try:
-                resp = requests.get(base.format(query=query.replace(" ", "+")), headers=HEADERS, timeout=10)
-                soup = BeautifulSoup(resp.text, "html.parser")
-                imgs = [img.get("src") or img.get("data-src") for img in soup.find_all("img")]
-                imgs = [u for u in imgs if u and u.startswith("http") and not u.endswith(".svg")]
-
-                # Prefer large / wallpaper-related URLs
-                imgs = [u for u in imgs if any(k in u.lower() for k in ["wallpaper", "1920", "1080", "4k", "wide"])]
-
-                if imgs:
-                    urls.extend(imgs)
-                    if len(urls) >= count:
-                        break
-            except Exception as se:
-                print(f"[ImageSearch] Fallback site error: {se}")
+                got = fut.result()
+            except Exception as e:
+                print(f"[ImageSearch] Fallback site error: {e}")
                 continue
+            fresh = [u for u in got if u not in seen]
+            seen.update(fresh)
+            need = count - len(urls)
+            urls.extend(fresh[:need])
+            _return_candidates(source, query, fresh[need:])
+            if len(urls) >= count:
+                break
+    finally:
+        # Don't wait for the slower sites; what they took goes back to the
+        # cache when they finish.
+        for fut, source in futures.items():
+            fut.add_done_callback(lambda f, source=source: _return_late(f, source, query))
+        pool.shutdown(wait=False, cancel_futures=True)
+    return urls
+
+
+def _return_late(fut, source, query):
+    if fut.cancelled() or fut.exception() is not None:
+        return
+    _return_candidates(source, query, fut.result())
+
 
-        urls = list(dict.fromkeys(urls))
+def get_imagesearch_results(query, count=1):
+    """Fetch high-quality wallpaper images using DuckDuckGo (with fallback)."""
+    # --- 1️⃣ Try DuckDuckGo image search ---
+    urls = _take_candidates("ddg", query, count, _ddg_page)
+    if len(urls) >= count:
+        return urls[:count]
+
+    # --- 2️⃣ Fallback: scrape wallpaper sites if DDG fails ---
+    try:
+        urls.extend(_fallback_results(query, count - len(urls), exclude=urls))
         random.shuffle(urls)
         return urls[:count]
     except Exception as e:
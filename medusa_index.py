@@ -0,0 +1,236 @@
+# medusa_index.py
+import os
+import json
+import threading
+from PIL import Image
+
+INDEX_FILE = ".medusa_index.jsonl"
+
+# dHash is 64 bits; splitting it into 4 bands of 16 means any two hashes
+# within NEAR_DUP_DISTANCE (< 4) bits share at least one band exactly, so
+# near-duplicate lookup is a few dict probes instead of a library scan.
+PHASH_BANDS = 4
+NEAR_DUP_DISTANCE = 3
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def perceptual_hash(path):
+    """64-bit difference hash (dHash) of an image file, as an int."""
+    with Image.open(path) as im:
+        # Let JPEGs decode at a fraction of full size; we only need 9x8 pixels.
+        im.draft("L", (64, 64))
+        small = im.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+        px = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+
+def _bands(phash):
+    return [(i, (phash >> (16 * i)) & 0xFFFF) for i in range(PHASH_BANDS)]
+
+
+class DedupIndex:
+    """Persistent URL / SHA-256 / perceptual-hash index of the files in a wall_dir.
+
+    Records are appended to wall_dir/.medusa_index.jsonl as they happen and
+    replayed on load, so adding or removing an entry never rewrites the file.
+    """
+
+    def __init__(self, wall_dir):
+        self.wall_dir = wall_dir
+        self.path = os.path.join(wall_dir, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._entries = {}      # file name -> {"url", "sha256", "phash"}
+        self._by_url = {}
+        self._urls_of = {}      # file name -> every URL that resolved to it
+        self._by_sha = {}
+        self._by_band = {}      # (band, value) -> set of file names
+        self._dead = 0
+        self._load()
+
+    # --- persistence ---
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    if rec.get("op") == "add":
+                        self._insert(rec["name"], rec.get("url"), rec.get("sha256"), rec.get("phash"))
+                    elif rec.get("op") == "url":
+                        if rec["name"] in self._entries:
+                            self._add_url(rec["url"], rec["name"])
+                    elif rec.get("op") == "del":
+                        self._drop(rec["name"])
+        except FileNotFoundError:
+            return
+        except Exception:
+            pass
+        if self._dead > max(1000, len(self._entries)):
+            self._compact()
+
+    def _append(self, rec):
+        try:
+            os.makedirs(self.wall_dir, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(rec) + "\n")
+        except Exception:
+            pass
+
+    def _compact(self):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                for name, e in self._entries.items():
+                    f.write(json.dumps({"op": "add", "name": name, **e}) + "\n")
+                for url, name in self._by_url.items():
+                    if self._entries[name].get("url") != url:
+                        f.write(json.dumps({"op": "url", "name": name, "url": url}) + "\n")
+            os.replace(tmp, self.path)
+            self._dead = 0
+        except Exception:
+            pass
+
+    # --- in-memory maps ---
+    def _add_url(self, url, name):
+        self._by_url[url] = name
+        self._urls_of.setdefault(name, set()).add(url)
+
+    def _insert(self, name, url, sha256, phash):
+        self._entries[name] = {"url": url, "sha256": sha256, "phash": phash}
+        if url:
+            self._add_url(url, name)
+        if sha256:
+            self._by_sha[sha256] = name
+        if phash is not None:
+            for band in _bands(phash):
+                self._by_band.setdefault(band, set()).add(name)
+
+    def _drop(self, name):
+        e = self._entries.pop(name, None)
+        if e is None:
+            return
+        self._dead += 1
+        for url in self._urls_of.pop(name, ()):
+            if self._by_url.get(url) == name:
+                del self._by_url[url]
+        if self._by_sha.get(e["sha256"]) == name:
+            del self._by_sha[e["sha256"]]
+        if e["phash"] is not None:
+            for band in _bands(e["phash"]):
+                names = self._by_band.get(band)
+                if names:
+                    names.discard(name)
+                    if not names:
+                        del self._by_band[band]
+
+    def _alive(self, name):
+        # Files can vanish behind our back (file manager, other tools).
+        if name and os.path.exists(os.path.join(self.wall_dir, name)):
+            return name
+        if name:
+            self._drop(name)
+            self._append({"op": "del", "name": name})
+        return None
+
+    # --- public API ---
+    def has_url(self, url):
+        with self._lock:
+            return self._alive(self._by_url.get(url)) is not None
+
+    def find_duplicate(self, sha256, phash=None):
+        """Name of an indexed file with the same bytes or a near-identical picture."""
+        with self._lock:
+            return self._find(sha256, phash)
+
+    def _find(self, sha256, phash):
+        name = self._alive(self._by_sha.get(sha256))
+        if name or phash is None:
+            return name
+        for band in _bands(phash):
+            for other in list(self._by_band.get(band, ())):
+                other_hash = self._entries[other]["phash"]
+                if bin(other_hash ^ phash).count("1") <= NEAR_DUP_DISTANCE and self._alive(other):
+                    return other
+        return None
+
+    def add_if_new(self, path, url, sha256, phash=None):
+        """Index `path` unless it duplicates an existing file; returns that file's name if so.
+
+        Check and insert happen under one lock so concurrent workers can't both
+        keep copies of the same image. A duplicate's URL is remembered too, so
+        the next refresh skips it before downloading.
+        """
+        name = os.path.basename(path)
+        with self._lock:
+            dup = self._find(sha256, phash)
+            if dup:
+                if url and url not in self._by_url:
+                    self._add_url(url, dup)
+                    self._append({"op": "url", "name": dup, "url": url})
+                return dup
+            self._insert(name, url, sha256, phash)
+            self._append({"op": "add", "name": name, "url": url, "sha256": sha256, "phash": phash})
+        return None
+
+    def remove(self, path):
+        name = os.path.basename(path)
+        with self._lock:
+            if name in self._entries:
+                self._drop(name)
+                self._append({"op": "del", "name": name})
+
+    def rename(self, old_path, new_path):
+        """Move an entry to a new file name (e.g. after re-encoding); URLs and hashes stay."""
+        old, new = os.path.basename(old_path), os.path.basename(new_path)
+        with self._lock:
+            e = self._entries.get(old)
+            if e is None or old == new:
+                return
+            extra = [u for u in self._urls_of.get(old, ()) if u != e["url"]]
+            self._drop(old)
+            self._insert(new, e["url"], e["sha256"], e["phash"])
+            self._append({"op": "del", "name": old})
+            self._append({"op": "add", "name": new, **e})
+            for url in extra:
+                self._add_url(url, new)
+                self._append({"op": "url", "name": new, "url": url})
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_url.clear()
+            self._urls_of.clear()
+            self._by_sha.clear()
+            self._by_band.clear()
+            self._dead = 0
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_index(wall_dir):
+    """Shared DedupIndex for `wall_dir` (one instance per directory per process)."""
+    key = os.path.abspath(wall_dir)
+    with _indexes_lock:
+        idx = _indexes.get(key)
+        if idx is None:
+            idx = _indexes[key] = DedupIndex(key)
+        return idx
+
+
+def forget_index(wall_dir):
+    """Drop the cached DedupIndex for `wall_dir`, e.g. after its folder was swapped out."""
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(wall_dir), None)
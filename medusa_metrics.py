@@ -0,0 +1,198 @@
+# medusa_metrics.py
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+METRICS_FILE = os.path.join(os.path.expanduser("~"), ".medusa_metrics.jsonl")
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open.
+HIST_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Per-thread stage timings for the image being worked on; see collect().
+_local = threading.local()
+
+
+def classify(exc):
+    """Short failure category for an exception, for grouping in the metrics."""
+    category = getattr(exc, "category", None)
+    if category:
+        return category
+    import requests     # already loaded by whoever raised a network error
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return f"http_{exc.response.status_code}"
+    if isinstance(exc, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return "connection"
+    if isinstance(exc, ValueError):
+        return "bad_response"
+    return "other"
+
+
+class RunMetrics:
+    """Stage timings, per-provider latency histograms, bytes and failures for one run.
+
+    Safe to update from any worker thread.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.images = 0
+        self.stages = {}        # stage -> {"count", "total_s", "max_s"}
+        self.latency = {}       # provider -> stage -> {"count", "total_ms", "buckets"}
+        self.bytes = {}         # provider -> bytes transferred
+        self.saved = {}         # provider -> bytes saved by post-processing
+        self.failures = {}      # provider -> category -> count
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage, provider=None):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - t0, provider)
+
+    def record(self, stage, seconds, provider=None):
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        with self._lock:
+            st = self.stages.setdefault(stage, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            st["count"] += 1
+            st["total_s"] += seconds
+            st["max_s"] = max(st["max_s"], seconds)
+            if provider:
+                ms = seconds * 1000.0
+                h = self.latency.setdefault(provider, {}).setdefault(
+                    stage, {"count": 0, "total_ms": 0.0, "buckets": [0] * (len(HIST_BUCKETS_MS) + 1)})
+                h["count"] += 1
+                h["total_ms"] += ms
+                i = 0
+                while i < len(HIST_BUCKETS_MS) and ms > HIST_BUCKETS_MS[i]:
+                    i += 1
+                h["buckets"][i] += 1
+
+    def add_bytes(self, provider, n):
+        with self._lock:
+            self.bytes[provider] = self.bytes.get(provider, 0) + n
+
+    def add_saved(self, provider, n):
+        with self._lock:
+            self.saved[provider] = self.saved.get(provider, 0) + n
+
+    def add_image(self):
+        with self._lock:
+            self.images += 1
+
+    def failure(self, provider, reason):
+        category = reason if isinstance(reason, str) else classify(reason)
+        with self._lock:
+            per = self.failures.setdefault(provider or "unknown", {})
+            per[category] = per.get(category, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "duration_s": round(time.time() - self.started, 3),
+                "images": self.images,
+                "bytes": dict(self.bytes),
+                "bytes_saved": dict(self.saved),
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "latency_ms": {p: {s: dict(h, buckets=list(h["buckets"])) for s, h in d.items()}
+                               for p, d in self.latency.items()},
+                "buckets_ms": list(HIST_BUCKETS_MS),
+                "failures": {p: dict(c) for p, c in self.failures.items()}
+            }
+
+
+_current = RunMetrics()
+_last_summary = None
+# The run the current thread works for; runs in different threads (a GUI
+# download next to a background refill) each keep their own numbers.
+_run = contextvars.ContextVar("medusa_run", default=None)
+
+
+def start_run():
+    """Begin a fresh metrics run; module-level helpers in this context record into it."""
+    global _current
+    _current = RunMetrics()
+    _run.set(_current)
+    return _current
+
+
+def bind(fn):
+    """Wrap `fn` so it records into the caller's run when a worker thread calls it."""
+    run = current()
+
+    def bound(*args, **kwargs):
+        token = _run.set(run)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _run.reset(token)
+    return bound
+
+
+def finish_run(metrics, path=METRICS_FILE, remember=True):
+    """Append the run's summary as one JSON line and, if `remember`, keep it for last_run()."""
+    global _last_summary
+    summary = metrics.summary()
+    if remember:
+        _last_summary = summary
+    if path:
+        try:
+            with open(path, "a") as f:
+                f.write(json.dumps(summary) + "\n")
+        except Exception:
+            pass
+    return summary
+
+
+def last_run():
+    return _last_summary
+
+
+def current():
+    return _run.get() or _current
+
+
+@contextmanager
+def collect():
+    """Also gather the stage timings recorded by this thread into a dict while active."""
+    prev = getattr(_local, "timings", None)
+    _local.timings = timings = {}
+    try:
+        yield timings
+    finally:
+        _local.timings = prev
+
+
+def timer(stage, provider=None):
+    return current().timer(stage, provider)
+
+
+def add_bytes(provider, n):
+    current().add_bytes(provider, n)
+
+
+def failure(provider, reason):
+    current().failure(provider, reason)
+
+
+def format_summary(summary):
+    """One-line human readable digest of a run summary."""
+    if not summary:
+        return ""
+    mb = sum(summary["bytes"].values()) / (1024 * 1024)
+    failed = sum(sum(c.values()) for c in summary["failures"].values())
+    stages = ", ".join(f"{k} {v['total_s']:.1f}s" for k, v in sorted(summary["stages"].items()))
+    saved = sum(summary.get("bytes_saved", {}).values()) / (1024 * 1024)
+    saved = f", {saved:.1f} MB saved" if saved else ""
+    return (f"{summary['images']} images, {mb:.1f} MB in {summary['duration_s']:.1f}s{saved}, "
+            f"{failed} failures ({stages})")
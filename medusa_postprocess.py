@@ -0,0 +1,117 @@
+# medusa_postprocess.py
+import os
+import time
+from PIL import Image, ImageOps
+from medusa_thumbs import make_thumbnail, remove_thumbnails
+from medusa_config import POSTPROCESS_DEFAULTS
+
+# Kept light on purpose: worker processes are spawned fresh and import
+# only this module, Pillow, medusa_thumbs and the stdlib-only medusa_config.
+
+FORMATS = {"jpeg": ("JPEG", "jpg"), "jpg": ("JPEG", "jpg"), "webp": ("WEBP", "webp"), "png": ("PNG", "png")}
+
+
+def postprocess_options(cfg):
+    """The cfg['postprocess'] block with defaults filled in, or None when disabled."""
+    opts = dict(POSTPROCESS_DEFAULTS)
+    opts.update(cfg.get("postprocess") or {})
+    if not opts.get("enabled"):
+        return None
+    sizes = opts.get("sizes") or ([cfg["display_size"]] if cfg.get("display_size") else None)
+    if not sizes:
+        return None
+    opts["sizes"] = [(int(w), int(h)) for w, h in sizes]
+    try:
+        opts["workers"] = int(opts.get("workers") or 0) or max(1, (os.cpu_count() or 2) // 2)
+    except Exception:
+        opts["workers"] = 1
+    return opts
+
+
+def _target(size, sizes, crop):
+    """Output (w, h): the smallest scale that still covers every monitor, cropped if asked."""
+    w, h = size
+    cover_w = max(s[0] for s in sizes)
+    cover_h = max(s[1] for s in sizes)
+    if crop:
+        # Crop to the primary monitor's shape, at a size covering all of them.
+        aspect = sizes[0][0] / sizes[0][1]
+        crop_w, crop_h = (w, round(w / aspect)) if w / h <= aspect else (round(h * aspect), h)
+        scale = min(1.0, max(cover_w / crop_w, cover_h / crop_h))
+        return (crop_w, crop_h), (max(1, round(crop_w * scale)), max(1, round(crop_h * scale)))
+    scale = min(1.0, max(cover_w / w, cover_h / h))
+    return (w, h), (max(1, round(w * scale)), max(1, round(h * scale)))
+
+
+def process_image(path, opts):
+    """Fit one wallpaper to the display; runs in a worker process.
+
+    Returns {"path", "before", "after", "size", "cpu_s", "wall_s"}. The result
+    replaces the file (under a new extension if the format changes) only when
+    it was resized or cropped, or came out smaller.
+    """
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    before = os.path.getsize(path)
+    with Image.open(path) as im:
+        src_format = im.format
+        raw_w, raw_h = im.size
+        rotated = im.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+        oriented = (raw_h, raw_w) if rotated else (raw_w, raw_h)
+        crop_size, out_size = _target(oriented, opts["sizes"], opts.get("crop"))
+        scale = out_size[0] / crop_size[0]
+        if scale < 1.0:
+            # JPEGs can decode straight at a reduced scale when we shrink a lot.
+            im.draft("RGB", (int(raw_w * scale) + 1, int(raw_h * scale) + 1))
+        icc = im.info.get("icc_profile")
+        im = ImageOps.exif_transpose(im)
+    # Read after the transpose, which resets the orientation tag.
+    exif = None if opts.get("strip_metadata", True) else im.info.get("exif")
+
+    # draft() may have shrunk the decode; map the crop into its coordinates.
+    f = im.size[0] / oriented[0]
+    cw, ch = min(im.size[0], round(crop_size[0] * f)), min(im.size[1], round(crop_size[1] * f))
+    changed = im.size != oriented
+    if (cw, ch) != im.size:
+        left, top = (im.size[0] - cw) // 2, (im.size[1] - ch) // 2
+        im = im.crop((left, top, left + cw, top + ch))
+        changed = True
+    if im.size != out_size:
+        im = im.resize(out_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        changed = True
+
+    fmt = str(opts.get("format", "jpeg")).lower()
+    if fmt in FORMATS:
+        pil_format, ext = FORMATS[fmt]
+    else:
+        pil_format, ext = src_format, os.path.splitext(path)[1][1:]
+    if pil_format == "JPEG" and im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+    params = {}
+    if pil_format in ("JPEG", "WEBP"):
+        params["quality"] = int(opts.get("quality", 90))
+    if pil_format in ("JPEG", "PNG"):
+        params["optimize"] = True
+    if icc:
+        params["icc_profile"] = icc
+    if exif:
+        params["exif"] = exif
+
+    new_path = os.path.splitext(path)[0] + "." + ext
+    tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(new_path) + ".pp.tmp")
+    im.save(tmp, pil_format, **params)
+    after = os.path.getsize(tmp)
+    if not changed and after >= before:
+        # Re-encoding alone didn't pay off; keep the original bytes.
+        os.remove(tmp)
+        new_path, after = path, before
+    else:
+        remove_thumbnails(path)
+        os.replace(tmp, new_path)
+        if new_path != path:
+            os.remove(path)
+        try:
+            make_thumbnail(new_path)
+        except Exception:
+            pass
+    return {"path": new_path, "before": before, "after": after, "size": list(im.size),
+            "cpu_s": time.process_time() - cpu0, "wall_s": time.perf_counter() - wall0}
@@ -0,0 +1,243 @@
+# medusa_ratelimit.py
+import os
+import json
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from medusa_http import get_session
+import medusa_metrics as metrics
+
+STATE_FILE = os.path.join(os.path.expanduser("~"), ".medusa_ratelimit.json")
+
+# (requests per second, burst) per provider API. Image downloads are limited
+# per CDN host with DOWNLOAD_RATE instead, since they don't count against
+# the API quotas.
+DEFAULT_RATES = {
+    "Unsplash": (1.0, 3),
+    "Pexels": (2.0, 4),
+    # Optimistic on purpose: DEMO_KEY allows only 30 requests an hour, a real
+    # key 1000. The X-Ratelimit-* headers bring the bucket down via observe().
+    "NASA": (0.2, 1),
+    "ImageSearch": (1.0, 2),
+    "default": (2.0, 4)
+}
+DOWNLOAD_RATE = (8.0, 8)
+
+MAX_WAIT_SECONDS = 120          # longer blocks fail fast instead of stalling a run
+QUOTA_WINDOW_SECONDS = 3600     # assumed reset when a provider sends no reset time
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+LOW_QUOTA = 5                   # start stretching requests out below this many left
+
+
+class RateLimited(Exception):
+    category = "rate_limited"
+
+
+def _retry_after(value, now):
+    if not value:
+        return None
+    try:
+        return now + float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    """Token bucket for one provider or host that also learns from response headers.
+
+    `acquire()` blocks until a request may go out; `observe()` feeds back the
+    status and headers so Retry-After, X-Ratelimit-* and 429/5xx responses
+    slow the bucket down for every worker sharing it.
+    """
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = self.base_rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0    # wall clock, so it survives a restart
+        self.remaining = None
+        self.reset_at = None
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                blocked = max(0.0, self.blocked_until - time.time())
+                if blocked > MAX_WAIT_SECONDS:
+                    raise RateLimited(f"{self.name} rate limited for another {blocked:.0f}s")
+                if not blocked and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    break
+                wait = max(blocked, (1.0 - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            metrics.current().record("ratelimit_wait", waited, self.name)
+
+    def observe(self, status, headers):
+        now = time.time()
+        with self._lock:
+            remaining = headers.get("X-Ratelimit-Remaining")
+            if remaining is not None and str(remaining).strip().lstrip("-").isdigit():
+                self.remaining = int(remaining)
+                reset = headers.get("X-Ratelimit-Reset")
+                if reset and str(reset).isdigit():
+                    # Pexels sends a unix timestamp; small values are "seconds from now".
+                    self.reset_at = float(reset) if int(reset) > 10 ** 9 else now + float(reset)
+                elif self.reset_at is None or self.reset_at < now:
+                    self.reset_at = now + QUOTA_WINDOW_SECONDS
+                self._apply_quota(now)
+
+            if status == 429 or status >= 500:
+                self.failures += 1
+                backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+                until = now + backoff * random.uniform(0.5, 1.0)
+                retry_at = _retry_after(headers.get("Retry-After"), now)
+                if retry_at:
+                    until = max(until, retry_at)
+                self.blocked_until = max(self.blocked_until, until)
+            elif status < 400:
+                self.failures = 0
+
+    def _apply_quota(self, now):
+        # Spread what's left of the quota over the rest of its window.
+        if self.remaining is None or self.reset_at is None or self.reset_at <= now:
+            self.rate = self.base_rate
+            return
+        if self.remaining <= 0:
+            self.blocked_until = max(self.blocked_until, self.reset_at)
+        elif self.remaining < LOW_QUOTA:
+            self.rate = min(self.base_rate, self.remaining / (self.reset_at - now))
+        else:
+            self.rate = self.base_rate
+
+    def set_rate(self, rate, burst):
+        """Change rate and burst in place; tokens already earned are kept (up to the new burst)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.base_rate = float(rate)
+            self.capacity = max(1.0, float(burst))
+            self.tokens = min(self.tokens, self.capacity)
+            self._apply_quota(time.time())
+
+    def snapshot(self):
+        with self._lock:
+            return {"remaining": self.remaining, "reset_at": self.reset_at,
+                    "blocked_until": self.blocked_until}
+
+    def restore(self, saved):
+        now = time.time()
+        with self._lock:
+            if (saved.get("blocked_until") or 0) > now:
+                self.blocked_until = saved["blocked_until"]
+            if (saved.get("reset_at") or 0) > now:
+                self.remaining = saved.get("remaining")
+                self.reset_at = saved["reset_at"]
+                self._apply_quota(now)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_rates = dict(DEFAULT_RATES)
+_saved = None
+
+
+def _load_saved():
+    global _saved
+    if _saved is None:
+        try:
+            with open(STATE_FILE, "r") as f:
+                _saved = json.load(f)
+        except Exception:
+            _saved = {}
+    return _saved
+
+
+def configure_limits(overrides):
+    """Override (rate, burst) per provider, e.g. cfg['rate_limits'].
+
+    Replaces the previous overrides, and buckets already in use switch to
+    the new rates right away. "download" sets the image-download rate for
+    every host, "download:<host>" for one host.
+    """
+    rates = dict(DEFAULT_RATES)
+    for name, value in (overrides or {}).items():
+        try:
+            rate, burst = value
+            rates[name] = (float(rate), int(burst))
+        except Exception:
+            pass
+    with _buckets_lock:
+        _rates.clear()
+        _rates.update(rates)
+        buckets = list(_buckets.items())
+    for key, bucket in buckets:
+        bucket.set_rate(*_rate_for(key))
+
+
+def _rate_for(key):
+    if key.startswith("download:"):
+        return _rates.get(key, _rates.get("download", DOWNLOAD_RATE))
+    return _rates.get(key, _rates["default"])
+
+
+def get_limiter(name, download=False):
+    """Shared bucket for a provider name, or for a CDN host when download=True."""
+    key = f"download:{name}" if download else name
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(key, *_rate_for(key))
+            saved = _load_saved().get(key)
+            if saved:
+                bucket.restore(saved)
+        return bucket
+
+
+def save_state():
+    """Persist known quotas and blocks so the next process doesn't spend them again."""
+    now = time.time()
+    with _buckets_lock:
+        state = dict(_load_saved())
+        for key, bucket in _buckets.items():
+            snap = bucket.snapshot()
+            if (snap["blocked_until"] or 0) > now or (snap["reset_at"] or 0) > now:
+                state[key] = snap
+        state = {k: v for k, v in state.items()
+                 if max(v.get("blocked_until") or 0, v.get("reset_at") or 0) > now}
+    try:
+        tmp = STATE_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, STATE_FILE)
+    except Exception:
+        pass
+
+
+def limited_request(name, method, url, download=False, retries=2, **kwargs):
+    """Send a request through `name`'s bucket, waiting out and retrying 429s."""
+    bucket = get_limiter(name, download)
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        resp = get_session().request(method, url, **kwargs)
+        bucket.observe(resp.status_code, resp.headers)
+        if resp.status_code != 429 or attempt == retries:
+            return resp
+        resp.close()
+    return resp
@@ -0,0 +1,256 @@
+# medusa_retention.py
+import os
+import time
+import shutil
+import tempfile
+from medusa_index import get_index, forget_index
+from medusa_catalog import get_catalog, forget_catalog
+from medusa_thumbs import THUMB_DIR, remove_thumbnails, prune_thumbnails
+
+STAGING_SUFFIX = ".medusa-staging"
+OLD_SUFFIX = ".medusa-old"
+LOCK_SUFFIX = ".medusa-lock"
+
+_staged = {}    # staging folder -> (open lock file, the library it will replace)
+
+
+def _sibling(wall_dir, suffix):
+    # Next to wall_dir rather than inside it, so the swap is a plain rename
+    # on the same filesystem.
+    return os.path.abspath(wall_dir).rstrip("/\\") + suffix
+
+
+def _lock_library(wall_dir):
+    """Block until this process holds wall_dir's replace lock; returns the open lock file.
+
+    The OS drops the lock if the process dies, so a crashed run never keeps
+    the next one waiting.
+    """
+    f = open(_sibling(wall_dir, LOCK_SUFFIX), "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    except Exception:
+        f.close()
+        raise
+    return f
+
+
+def _unlock(staging):
+    lock, _ = _staged.pop(staging, (None, None))
+    if lock is not None:
+        lock.close()
+
+
+def begin_staging(wall_dir):
+    """Fresh, empty staging directory for a run that will replace wall_dir; None if unusable.
+
+    Runs replacing the same library take turns: this waits until any other
+    one has committed or discarded its staging folder.
+    """
+    parent, name = os.path.split(_sibling(wall_dir, ""))
+    try:
+        os.makedirs(parent, exist_ok=True)
+        lock = _lock_library(wall_dir)
+    except OSError:
+        return None
+    try:
+        # With the lock held no live run owns any of these; they are left
+        # over from crashed runs.
+        for entry in sorted(os.listdir(parent)):
+            path = os.path.join(parent, entry)
+            if entry.startswith(name + OLD_SUFFIX) and not os.path.exists(wall_dir):
+                # A crash mid-swap: this is still the library.
+                os.replace(path, wall_dir)
+            elif entry.startswith(name + STAGING_SUFFIX) or entry.startswith(name + OLD_SUFFIX):
+                _remove_leftover(path, wall_dir)
+        os.makedirs(wall_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=name + STAGING_SUFFIX + "-", dir=parent)
+    except OSError:
+        lock.close()
+        return None
+    _staged[staging] = (lock, wall_dir)
+    forget_index(staging)
+    forget_catalog(staging)
+    return staging
+
+
+def _remove_leftover(folder, wall_dir):
+    """Delete a staging or old library folder, but hand back any user sub-folders in it first."""
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(folder, name)
+        if name == THUMB_DIR or not os.path.isdir(path):
+            continue
+        target = os.path.join(wall_dir, name)
+        try:
+            if os.path.exists(target):
+                raise OSError(f"{target} exists")
+            os.replace(path, target)
+        except OSError as e:
+            # Rather leave the whole folder behind than delete user data.
+            print(f"[Medusa] Kept {folder}: could not move {name} back ({e})")
+            return
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def discard_staging(staging):
+    forget_index(staging)
+    forget_catalog(staging)
+    _, wall_dir = _staged.get(staging, (None, None))
+    if wall_dir is None:
+        # Staging folders are siblings named after their library.
+        wall_dir = os.path.join(os.path.dirname(staging), os.path.basename(staging).split(STAGING_SUFFIX)[0])
+    _remove_leftover(staging, wall_dir)
+    _unlock(staging)
+
+
+def _swap_dirs(wall_dir, staging):
+    parent, name = os.path.split(_sibling(wall_dir, ""))
+    old = tempfile.mkdtemp(prefix=name + OLD_SUFFIX + "-", dir=parent)
+    os.rmdir(old)   # only the unique name is wanted; wall_dir is renamed to it
+    # The old nuke only deleted files, so sub-folders the user keeps in the
+    # library carry over into the new one.
+    moved = []
+    try:
+        for entry in os.listdir(wall_dir):
+            src = os.path.join(wall_dir, entry)
+            if entry != THUMB_DIR and os.path.isdir(src):
+                os.replace(src, os.path.join(staging, entry))
+                moved.append(entry)
+        os.replace(wall_dir, old)
+        try:
+            os.replace(staging, wall_dir)
+        except OSError:
+            os.replace(old, wall_dir)
+            raise
+    except OSError:
+        # Back to where we started, so the caller can fall back to _swap_files.
+        for entry in moved:
+            os.replace(os.path.join(staging, entry), os.path.join(wall_dir, entry))
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _swap_files(wall_dir, staging):
+    # Fallback when the folder itself can't be renamed (e.g. open in another
+    # program on Windows): swap the contents one rename at a time instead.
+    # The new files go in first, so a failure part way never leaves the
+    # library with neither set; old files that can't be removed just stay.
+    old = [name for name in os.listdir(wall_dir) if os.path.isfile(os.path.join(wall_dir, name))]
+    thumbs = os.path.join(wall_dir, THUMB_DIR)
+    os.makedirs(thumbs, exist_ok=True)
+    staged_thumbs = os.path.join(staging, THUMB_DIR)
+    if os.path.isdir(staged_thumbs):
+        for name in os.listdir(staged_thumbs):
+            os.replace(os.path.join(staged_thumbs, name), os.path.join(thumbs, name))
+        os.rmdir(staged_thumbs)
+    new = set()
+    for name in os.listdir(staging):
+        os.replace(os.path.join(staging, name), os.path.join(wall_dir, name))
+        new.add(name)
+    os.rmdir(staging)
+    kept = 0
+    for name in old:
+        if name in new:
+            continue    # the index and catalog, replaced by the staged ones
+        try:
+            os.remove(os.path.join(wall_dir, name))
+        except OSError:
+            kept += 1
+    prune_thumbnails(wall_dir)
+    if kept:
+        print(f"[Medusa] {kept} old wallpapers could not be removed and stay in the library")
+
+
+def commit_staging(wall_dir, staging):
+    """Replace the contents of wall_dir with the staged library."""
+    # Open catalogs must let go of their files before the folders move.
+    forget_index(staging)
+    forget_catalog(staging)
+    forget_index(wall_dir)
+    forget_catalog(wall_dir)
+    try:
+        try:
+            _swap_dirs(wall_dir, staging)
+        except OSError:
+            _swap_files(wall_dir, staging)
+    finally:
+        forget_index(wall_dir)
+        forget_catalog(wall_dir)
+        _unlock(staging)
+
+
+def _library_files(wall_dir):
+    files = []
+    try:
+        with os.scandir(wall_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                files.append((entry.path, st))
+    except OSError:
+        pass
+    return files
+
+
+def mark_used(path):
+    """Bump a wallpaper's access time so LRU eviction keeps it; mtime stays put."""
+    try:
+        st = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def enforce_retention(wall_dir, max_files=0, max_bytes=0, policy="lru", keep=(), kept_since=None):
+    """Evict wallpapers until wall_dir is within max_files / max_bytes (0 = no limit).
+
+    policy "age" evicts the oldest downloads first, "lru" the ones least
+    recently used (set as wallpaper or opened). Paths in `keep`, and files
+    modified at or after `kept_since` -- usually this run's downloads --
+    are never evicted. Returns the evicted paths.
+    """
+    if not max_files and not max_bytes:
+        return []
+    files = _library_files(wall_dir)
+    keep = {os.path.abspath(p) for p in keep}
+    if policy == "age":
+        files.sort(key=lambda f: f[1].st_mtime)
+    else:
+        files.sort(key=lambda f: max(f[1].st_atime, f[1].st_mtime))
+    count = len(files)
+    total = sum(st.st_size for _, st in files)
+    index = get_index(wall_dir)
+    catalog = get_catalog(wall_dir)
+    evicted = []
+    for path, st in files:
+        if (not max_files or count <= max_files) and (not max_bytes or total <= max_bytes):
+            break
+        if os.path.abspath(path) in keep or (kept_since is not None and st.st_mtime >= kept_since):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        index.remove(path)
+        catalog.remove(path)
+        remove_thumbnails(path)
+        evicted.append(path)
+        count -= 1
+        total -= st.st_size
+    return evicted
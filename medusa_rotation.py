@@ -0,0 +1,274 @@
+# medusa_rotation.py
+import os
+import json
+import math
+import time
+import random
+import threading
+from contextlib import contextmanager
+from medusa_config import HOME, ROTATION_DEFAULTS
+
+# Light on purpose: the GUI imports this at start-up, and the download stack
+# is only loaded by the first refill.
+
+QUEUE_FILE = os.path.join(HOME, ".medusa_rotation.json")
+
+EWMA_WEIGHT = 0.3           # share of the newest observation in the running averages
+DEFAULT_FETCH_SECONDS = 20.0
+REFILL_SAFETY = 2.0         # buffer covers this many refill times
+REFILL_POLL_SECONDS = 60
+RETRY_BASE_SECONDS = 30     # after a refill that brought nothing; doubles per failure
+RETRY_MAX_SECONDS = 1800
+
+
+def rotation_options(cfg):
+    opts = dict(ROTATION_DEFAULTS)
+    opts.update(cfg.get("rotation") or {})
+    try:
+        opts["interval_minutes"] = max(0.1, float(opts["interval_minutes"]))
+        opts["min_buffer"] = max(1, int(opts["min_buffer"]))
+        opts["max_buffer"] = max(opts["min_buffer"], int(opts["max_buffer"]))
+    except Exception:
+        opts.update({k: ROTATION_DEFAULTS[k] for k in ("interval_minutes", "min_buffer", "max_buffer")})
+    return opts
+
+
+def query_key(q):
+    return f"{q.get('api')}|{str(q.get('query', '')).strip()}"
+
+
+def _ewma(old, new):
+    return new if old is None else (1 - EWMA_WEIGHT) * old + EWMA_WEIGHT * new
+
+
+def _lower_priority():
+    # Linux applies a thread's nice value to that thread only, and threads it
+    # starts (the refill's download pool) inherit it. Elsewhere this is a no-op.
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except Exception:
+        pass
+
+
+class Rotator:
+    """Prefetch buffer behind wallpaper rotation.
+
+    Keeps a queue of downloaded, verified and display-fitted wallpapers per
+    query and refills it from a background thread. next() only pops from the
+    queues, so a rotation never waits on the network. Each query's depth is
+    sized from the observed rotation rate and refill time (see depth()).
+    """
+
+    def __init__(self, cfg, apply, state_file=QUEUE_FILE):
+        self.apply = apply
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._busy = threading.Lock()   # held by a refill, or by a manual run via paused()
+        self.queues = {}        # query key -> ready paths, oldest first
+        self.fetch_s = {}       # query key -> average refill seconds per wallpaper
+        self.failures = {}      # query key -> refills in a row that brought nothing
+        self.retry_at = {}      # query key -> time before which it isn't refilled again
+        self.gap_s = None       # average seconds between rotations
+        self.last_rotation = None
+        self._turn = 0
+        self._load()
+        self.configure(cfg)
+
+    # --- state ---
+    def _load(self):
+        try:
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+        except Exception:
+            return
+        self.queues = {k: [p for p in v if os.path.isfile(p)] for k, v in state.get("queues", {}).items()}
+        self.fetch_s = dict(state.get("fetch_s", {}))
+        self.gap_s = state.get("gap_s")
+
+    def _save(self):
+        with self._lock:
+            state = {"queues": self.queues, "fetch_s": self.fetch_s, "gap_s": self.gap_s}
+            data = json.dumps(state, indent=2)
+        try:
+            tmp = self.state_file + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, self.state_file)
+        except Exception:
+            pass
+
+    def configure(self, cfg):
+        """Pick up edited settings; queues of queries that were removed are dropped."""
+        with self._lock:
+            self.cfg = cfg
+            self.opts = rotation_options(cfg)
+            self.queries = [q for q in cfg.get("queries", []) if str(q.get("query", "")).strip()]
+            keys = {query_key(q) for q in self.queries}
+            self.queues = {k: v for k, v in self.queues.items() if k in keys}
+        self._wake.set()
+
+    # --- sizing ---
+    def interval_seconds(self):
+        return self.opts["interval_minutes"] * 60.0
+
+    def depth(self, key):
+        """Wallpapers to keep ready for one query.
+
+        A query comes up once every len(queries) rotations, so its buffer
+        must last the time a refill takes at that rate, with some slack;
+        the refill time is what past refills of this query actually took.
+        """
+        gap = self.gap_s or self.interval_seconds()
+        per_query_gap = max(1.0, gap * max(1, len(self.queries)))
+        fetch = self.fetch_s.get(key, DEFAULT_FETCH_SECONDS)
+        need = math.ceil(REFILL_SAFETY * fetch / per_query_gap) + 1
+        return max(self.opts["min_buffer"], min(self.opts["max_buffer"], need))
+
+    def status(self):
+        """(ready wallpapers, target) summed over all queries."""
+        with self._lock:
+            keys = [query_key(q) for q in self.queries]
+            return (sum(len(self.queues.get(k, [])) for k in keys),
+                    sum(self.depth(k) for k in keys))
+
+    # --- rotation ---
+    def next(self):
+        """Apply the next ready wallpaper, taking the queries in turn; returns its path.
+
+        Falls back to a random picture already in the library when every
+        queue is empty, so this never waits on a download.
+        """
+        now = time.time()
+        path = None
+        with self._lock:
+            if self.last_rotation is not None:
+                self.gap_s = _ewma(self.gap_s, max(1.0, now - self.last_rotation))
+            self.last_rotation = now
+            n = len(self.queries)
+            for i in range(n):
+                key = query_key(self.queries[(self._turn + i) % n])
+                queue = self.queues.get(key, [])
+                while queue and path is None:
+                    candidate = queue.pop(0)
+                    if os.path.isfile(candidate):    # may have been deleted or evicted
+                        path = candidate
+                if path:
+                    self._turn = (self._turn + i + 1) % n
+                    break
+        if path is None:
+            path = self._from_library()
+        if path:
+            self.apply(path)
+        self._save()
+        self._wake.set()
+        return path
+
+    def library_replaced(self, results):
+        """Re-seed the queues after a nuking run swapped the library.
+
+        The queued files went with the old library; the run's own new
+        downloads (iter_downloads results) take their place.
+        """
+        with self._lock:
+            self.queues = {k: [p for p in v if os.path.isfile(p)] for k, v in self.queues.items()}
+            keys = {query_key(q) for q in self.queries}
+            for r in results:
+                key = query_key({"api": r["provider"], "query": r["query"]})
+                queue = self.queues.setdefault(key, [])
+                if r["path"] and key in keys and r["path"] not in queue and len(queue) < self.depth(key):
+                    queue.append(r["path"])
+        self._save()
+        self._wake.set()
+
+    def _from_library(self):
+        wall_dir = self.cfg.get("wall_dir")
+        try:
+            with os.scandir(wall_dir) as it:
+                files = [e.path for e in it if not e.name.startswith(".") and e.is_file()]
+        except (OSError, TypeError):
+            return None
+        return random.choice(files) if files else None
+
+    # --- refilling ---
+    def start(self):
+        # Cleared even when the thread is still alive: a stop() followed by a
+        # start() during a long refill must keep that thread looping.
+        self._stop.clear()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    @contextmanager
+    def paused(self):
+        """Hold refills off while the caller runs its own download (waits for one in progress)."""
+        with self._busy:
+            yield
+
+    def _most_needed(self):
+        """(query, missing wallpapers) for the emptiest queue relative to its depth, or None."""
+        now = time.time()
+        best, best_score = None, 0.0
+        with self._lock:
+            for q in self.queries:
+                key = query_key(q)
+                if self.retry_at.get(key, 0) > now:
+                    continue
+                want = self.depth(key)
+                missing = want - len(self.queues.get(key, []))
+                if missing > 0 and missing / want > best_score:
+                    best, best_score = (q, missing), missing / want
+        return best
+
+    def _refill_loop(self):
+        _lower_priority()
+        while not self._stop.is_set():
+            job = self._most_needed()
+            if job is None:
+                self._wake.wait(REFILL_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            try:
+                with self._busy:
+                    self._refill(*job)
+            except Exception as e:
+                print(f"[Medusa] rotation refill error: {e}")
+                self._stop.wait(RETRY_BASE_SECONDS)
+
+    def _refill(self, q, missing):
+        from medusa_core import iter_downloads
+        key = query_key(q)
+        cfg = self.cfg
+        # One download at a time: refills are background work and shouldn't
+        # crowd out a manual run. Wallpapers are fitted to the display on the
+        # way in so showing them later is only a file switch.
+        # Marked background so it neither becomes the GUI's "last run" nor
+        # moves the daemon's last-run time.
+        run_cfg = dict(cfg, queries=[dict(q, count=missing)], nuke=False, max_workers=1, profile=False,
+                       background=True, postprocess=dict(cfg.get("postprocess") or {}, enabled=True))
+        t0 = time.perf_counter()
+        got = 0
+        for result in iter_downloads(run_cfg):
+            if result["path"]:
+                got += 1
+                with self._lock:
+                    self.queues.setdefault(key, []).append(result["path"])
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            if got:
+                self.fetch_s[key] = _ewma(self.fetch_s.get(key), elapsed / got)
+                self.failures.pop(key, None)
+                self.retry_at.pop(key, None)
+            else:
+                # Nothing arrived: count it as a slow refill so the buffer grows,
+                # and back off before asking this query again.
+                self.fetch_s[key] = _ewma(self.fetch_s.get(key), max(elapsed, DEFAULT_FETCH_SECONDS) * 2)
+                failures = self.failures[key] = self.failures.get(key, 0) + 1
+                self.retry_at[key] = time.time() + min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (failures - 1))
+        self._save()
@@ -0,0 +1,141 @@
+# medusa_thumbs.py
+import os
+import queue
+import itertools
+import threading
+from PIL import Image
+
+THUMB_DIR = ".thumbs"
+THUMB_SIZE = (360, 240)
+
+
+def _thumb_path(src, size):
+    # The source mtime is part of the name, so a replaced file never matches
+    # a stale thumbnail; prune_thumbnails() clears those out later.
+    st = os.stat(src)
+    folder = os.path.join(os.path.dirname(src), THUMB_DIR)
+    name = f"{os.path.basename(src)}__{size[0]}x{size[1]}__{st.st_mtime_ns}.jpg"
+    return os.path.join(folder, name)
+
+
+def make_thumbnail(src, size=THUMB_SIZE):
+    """Render and store the cached thumbnail for `src`; returns the thumbnail image."""
+    path = _thumb_path(src, size)
+    with Image.open(src) as im:
+        # JPEGs decode straight at a reduced scale, not at full resolution.
+        im.draft("RGB", (size[0] * 2, size[1] * 2))
+        im.thumbnail(size)
+        thumb = im.convert("RGB")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    thumb.save(tmp, "JPEG", quality=85)
+    os.replace(tmp, path)
+    return thumb
+
+
+def load_thumbnail(src, size=THUMB_SIZE):
+    """Cached thumbnail for `src`, rendering it on a miss."""
+    try:
+        with Image.open(_thumb_path(src, size)) as im:
+            im.load()
+            return im
+    except FileNotFoundError:
+        return make_thumbnail(src, size)
+
+
+def remove_thumbnails(src):
+    folder = os.path.join(os.path.dirname(src), THUMB_DIR)
+    prefix = os.path.basename(src) + "__"
+    try:
+        for name in os.listdir(folder):
+            if name.startswith(prefix):
+                os.remove(os.path.join(folder, name))
+    except OSError:
+        pass
+
+
+def prune_thumbnails(wall_dir):
+    """Drop thumbnails whose source file is gone or has changed since."""
+    folder = os.path.join(wall_dir, THUMB_DIR)
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return 0
+    removed = 0
+    for name in names:
+        if name.endswith(".tmp"):
+            continue  # being written right now
+        parts = name.rsplit("__", 2)
+        keep = False
+        if len(parts) == 3:
+            try:
+                src_mtime = os.stat(os.path.join(wall_dir, parts[0])).st_mtime_ns
+                keep = parts[2] == f"{src_mtime}.jpg"
+            except OSError:
+                pass
+        if not keep:
+            try:
+                os.remove(os.path.join(folder, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+class ThumbnailLoader:
+    """Decode thumbnails on background threads, most urgent first.
+
+    `deliver(path, image)` is called from a worker thread with the thumbnail,
+    or with None if the file could not be read; GUI callers should hop back to
+    their own thread from there. Lower `priority` values are served first.
+    """
+
+    def __init__(self, deliver, workers=3, size=THUMB_SIZE):
+        self.deliver = deliver
+        self.size = size
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {}      # path -> generation it was requested in
+        self._generation = 0
+        for _ in range(max(1, workers)):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def request(self, path, priority=0):
+        # Re-requesting a pending path just queues it again at the new
+        # priority; whichever copy is dequeued first does the work.
+        with self._lock:
+            self._pending[path] = self._generation
+            self._queue.put((priority, next(self._seq), self._generation, path))
+
+    def cancel(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def clear(self):
+        """Drop everything queued; results still in flight are discarded."""
+        with self._lock:
+            self._generation += 1
+            self._pending.clear()
+
+    def _current(self, path, generation):
+        with self._lock:
+            return self._pending.get(path) == generation
+
+    def _work(self):
+        while True:
+            _, _, generation, path = self._queue.get()
+            if not self._current(path, generation):
+                continue
+            try:
+                img = load_thumbnail(path, self.size)
+            except Exception:
+                img = None
+            with self._lock:
+                if self._pending.get(path) != generation:
+                    continue
+                del self._pending[path]
+            try:
+                self.deliver(path, img)
+            except Exception:
+                pass